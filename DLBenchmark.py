@@ -0,0 +1,413 @@
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import fitz
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QTransform
+from PySide6.QtWidgets import QApplication, QGraphicsPixmapItem
+
+from GUI.DLSearch import SearchIndex
+from GUI.DLStorage import SidebarStore
+from GUI.DLWidgets import _DocumentButton, _PageProducer, PdfView, Section, Sidebar, SidebarView
+
+
+PAGE_SIZES = ((595, 842), (612, 792), (1191, 842), (420, 595))  # A4, Letter, A3 landscape, A5
+
+def syntheticPdf(path, page_count=100, images=False, mixed=False):
+    # incompressible noise makes image pages expensive to decode and scale, it is stored once and shown on every page
+    noise = fitz.Pixmap(fitz.csRGB, 1200, 900, os.urandom(1200 * 900 * 3), False) if images else None
+    noise_xref = 0
+    with fitz.open() as pdf:
+        for page_num in range(page_count):
+            width, height = PAGE_SIZES[page_num % len(PAGE_SIZES)] if mixed else PAGE_SIZES[0]
+            page = pdf.new_page(width=width, height=height)
+            page.insert_textbox(fitz.Rect(50, 50, width - 50, height - 50),
+                                f'Protocol page {page_num}\n' + 'Lorem ipsum dolor sit amet. ' * 120)
+            page.draw_rect(fitz.Rect(50, height * 0.7, width - 50, height - 60), color=(0.2, 0.4, 0.8), fill=(0.8, 0.9, 1))
+            if images:
+                image_rect = fitz.Rect(50, height * 0.35, width - 50, height - 60)
+                noise_xref = page.insert_image(image_rect, xref=noise_xref) if noise_xref else \
+                    page.insert_image(image_rect, pixmap=noise)
+        pdf.save(path)
+    return path
+
+def pageSizes(path_to_pdf):
+    with fitz.open(path_to_pdf) as pdf:
+        return [(page.rect.width, page.rect.height) for page in pdf]
+
+def benchProducer(path_to_pdf, transport='raw', workers=1, depth=None, consume=True):
+    page_sizes = pageSizes(path_to_pdf)
+    page_count = len(page_sizes)
+    slot_size = _PageProducer.slotSize(page_sizes, transport)
+
+    producer = _PageProducer(transport, workers, depth)
+    producer.start()
+    gui_time = 0
+    start = time.perf_counter()
+    producer.open(path_to_pdf)
+    producer.reserve(slot_size)
+    producer.request(range(page_count))
+    while not producer.isIdle():
+        producer.viewer_conn.poll(None)
+        receive_start = time.perf_counter()
+        _, page_num, page_pixmap = producer.receive()
+        if consume:
+            # pages arrive at their display size, the viewer only places them
+            QGraphicsPixmapItem(page_pixmap).setTransform(QTransform.fromScale(1, 1))
+        gui_time += time.perf_counter() - receive_start
+    total_time = time.perf_counter() - start
+    producer.shutdown()
+
+    return {'transport': transport, 'workers': workers, 'depth': producer.depth, 'pages': page_count,
+            'shm_mb': slot_size * producer.depth / 2 ** 20, 'total_sec': total_time,
+            'ms_per_page': total_time / page_count * 1000, 'gui_ms_per_page': gui_time / page_count * 1000,
+            'pages_per_sec': page_count / total_time}
+
+def benchSwitching(paths, persistent=True, switches=10):
+    # time-to-first-page when clicking between documents, spawn-per-document when not persistent
+    documents = [(path_to_pdf, _PageProducer.slotSize(pageSizes(path_to_pdf))) for path_to_pdf in paths]
+
+    producer = _PageProducer()
+    producer.start()
+    first_page_times = []
+    for switch in range(switches):
+        start = time.perf_counter()
+        if not persistent:
+            producer.shutdown()
+            producer.start()
+        path_to_pdf, slot_size = documents[switch % len(documents)]
+        producer.open(path_to_pdf)
+        producer.reserve(slot_size)
+        producer.request(range(2))
+        while producer.receive() is None:
+            pass
+        first_page_times.append(time.perf_counter() - start)
+    producer.shutdown()
+
+    return {'persistent': persistent, 'switches': switches,
+            'first_page_ms': sum(first_page_times) / switches * 1000}
+
+def benchJump(path_to_pdf, visible=2, window=3, steps=10, jumps=5):
+    # a fast drag passes through intermediate viewports, then the visible pages of the target are awaited
+    page_sizes = pageSizes(path_to_pdf)
+    page_count = len(page_sizes)
+
+    producer = _PageProducer()
+    producer.start()
+    producer.open(path_to_pdf)
+    producer.reserve(_PageProducer.slotSize(page_sizes))
+    first_page, visible_times, stale_renders = 0, [], 0
+    for jump in range(jumps):
+        target = (first_page + page_count // 2 + jump * 13) % (page_count - visible)
+        for step in range(1, steps + 1):
+            step_page = first_page + (target - first_page) * step // (steps + 1)
+            producer.prioritise(step_page)
+            producer.request(range(max(0, step_page - window), min(page_count, step_page + visible + window)))
+            step_end = time.perf_counter() + 0.01
+            while time.perf_counter() < step_end:
+                if producer.viewer_conn.poll(0.001):
+                    producer.receive()
+
+        start = time.perf_counter()
+        producer.prioritise(target)
+        producer.request(range(max(0, target - window), min(page_count, target + visible + window)))
+        awaited = set(range(target, target + visible))
+        while awaited:
+            if page := producer.receive():
+                awaited.discard(page[1])
+                stale_renders += not target - window <= page[1] < target + visible + window
+        visible_times.append(time.perf_counter() - start)
+        first_page = target
+    producer.shutdown()
+
+    return {'pages': page_count, 'jumps': jumps, 'visible_ms': sum(visible_times) / jumps * 1000,
+            'stale_renders': stale_renders / jumps}
+
+def benchViewer(path_to_pdf, pages=40, jumps=5, trace_path=None):
+    # time-to-first-page, display rate and time until the visible pages are shown after a jump, event loop included
+    class _Emitter(QObject):
+        documentChanged = Signal(str)
+
+    app = QApplication.instance()
+    emitter = _Emitter()
+    view = PdfView(emitter.documentChanged)
+    view.resize(800, 600)
+    view.setPixmapLimit(2 ** 40)
+    view.setPageWindow(pages)
+    view.setTracing(trace_path is not None)
+    view.show()
+
+    start = time.perf_counter()
+    emitter.documentChanged.emit(path_to_pdf)
+    while not view.page_pixmaps:
+        app.processEvents()
+    first_page_time = time.perf_counter() - start
+    while len(view.page_pixmaps) < min(pages, view.page_geometry.pageCount()):
+        app.processEvents()
+    display_time = time.perf_counter() - start
+
+    view.setPageWindow(PdfView.PAGE_WINDOW)
+    page_count, jump_times = view.page_geometry.pageCount(), []
+    for jump in range(jumps):
+        start = time.perf_counter()
+        view.showPage((page_count // 2 + jump * 37) % page_count)
+        while not all(page_num in view.page_pixmaps for page_num in view._visible_pages()):
+            app.processEvents()
+        jump_times.append(time.perf_counter() - start)
+    shm_size = view.page_producer.slot_size * view.page_producer.depth
+
+    if trace_path:
+        # worker events still on their way arrive with the last results
+        while not view.page_producer.isIdle() or view.page_producer.viewer_conn.poll(0.1):
+            app.processEvents()
+        view.exportTrace(trace_path)
+        view.setTracing(False)
+    view.shutdown()
+    view.deleteLater()
+    return {'pages': page_count, 'first_page_ms': first_page_time * 1000,
+            'pages_per_sec': min(pages, page_count) / display_time, 'jump_ms': sum(jump_times) / jumps * 1000,
+            'shm_mb': shm_size / 2 ** 20}
+
+def benchSearch(index_path, documents=2000, pages=20, queries=100):
+    # index build and query latency over synthetic page texts, word frequencies follow Zipf's law like real text
+    vocabulary = [f'term{word_num}' for word_num in range(20000)]
+    frequencies = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    random.seed(0)
+    search_index = SearchIndex(index_path)
+    start = time.perf_counter()
+    for doc_num in range(documents):
+        page_texts = [' '.join(random.choices(vocabulary, frequencies, k=300)) for _ in range(pages)]
+        search_index.addDocument(f'document_{doc_num}', f'{doc_num:032x}', page_texts)
+    build_time = time.perf_counter() - start
+
+    query_times = []
+    for _ in range(queries):
+        query = ' '.join(random.sample(vocabulary, 2))[:-1]
+        start = time.perf_counter()
+        search_index.query(query)
+        query_times.append(time.perf_counter() - start)
+    search_index.close()
+
+    query_times.sort()
+    return {'documents': documents, 'pages': documents * pages, 'build_sec': build_time,
+            'index_mb': os.path.getsize(index_path) / 2 ** 20,
+            'query_ms': query_times[len(query_times) // 2] * 1000,
+            'query_p95_ms': query_times[int(len(query_times) * 0.95)] * 1000}
+
+def benchSidebarStore(tmp_dir, sections=100, documents=10, mutations=20):
+    # cost of one add-document click: whole sidebar.json rewrite against the incremental store
+    json_sidebar = {'Sections': [{'Path': f'./storage/sidebar/Section_{section_num}', 'Label': f'Section_{section_num}',
+                                  'Content': {f'Protocol {doc_num}': f'./storage/sidebar/Section_{section_num}/{doc_num:032x}'
+                                              for doc_num in range(documents)}}
+                                 for section_num in range(sections)]}
+    json_path = os.path.join(tmp_dir, f'sidebar_{sections}.json')
+    with open(json_path, 'wt') as _json:
+        json.dump(json_sidebar, _json)
+
+    start = time.perf_counter()
+    for mutation in range(mutations):
+        json_sidebar['Sections'][mutation % sections]['Content'][f'Added {mutation}'] = f'{mutation:032x}'
+        with open(json_path, 'wt') as _json:
+            json.dump(json_sidebar, _json)
+    json_time = (time.perf_counter() - start) / mutations
+
+    start = time.perf_counter()
+    sidebar_store = SidebarStore(os.path.join(tmp_dir, f'sidebar_{sections}.sqlite3'), json_path)
+    import_time = time.perf_counter() - start
+    images = sidebar_store.load()['Sections']
+    start = time.perf_counter()
+    for mutation in range(mutations):
+        image = images[mutation % sections]
+        image['Content'][f'Store added {mutation}'] = f'{mutation:032x}'
+        sidebar_store.updateSection(image)
+    store_time = (time.perf_counter() - start) / mutations
+    sidebar_store.close()
+
+    return {'sections': sections, 'documents': sections * documents, 'json_ms': json_time * 1000,
+            'store_ms': store_time * 1000, 'import_ms': import_time * 1000}
+
+def residentMemory():
+    # resident set size in bytes, Linux only
+    try:
+        with open('/proc/self/statm') as _statm:
+            return int(_statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return 0
+
+def benchSidebar(tmp_dir, sidebar_class, documents=1000, per_section=50, updates=10):
+    # startup of a sidebar with many documents: construction until the first frame is painted
+    app = QApplication.instance()
+    sidebar_dir = os.path.join(tmp_dir, f'{sidebar_class.__name__}_{documents}')
+    objects_path = os.path.join(sidebar_dir, 'objects/')
+    json_sidebar = {'Sections': [{'Path': os.path.join(sidebar_dir, f'Section_{section_num}'), 'Label': f'Section_{section_num}',
+                                  'Content': {f'Protocol {doc_num}': f'{objects_path}{section_num * per_section + doc_num:032x}'
+                                              for doc_num in range(min(per_section, documents - section_num * per_section))}}
+                                 for section_num in range(math.ceil(documents / per_section))]}
+    os.makedirs(objects_path)
+    json_path = os.path.join(sidebar_dir, 'sidebar.json')
+    with open(json_path, 'wt') as _json:
+        json.dump(json_sidebar, _json)
+
+    memory = residentMemory()
+    start = time.perf_counter()
+    sidebar = sidebar_class(sidebar_dir + '/', os.path.join(sidebar_dir, 'sidebar.sqlite3'), objects_path, 300, 800,
+                            path_to_json=json_path)
+    sidebar.show()
+    app.processEvents()
+    startup_time = time.perf_counter() - start
+    memory = residentMemory() - memory
+
+    # one added document, written through to the store, as the add action does after the import
+    start = time.perf_counter()
+    for update in range(updates):
+        section_num = update % len(json_sidebar['Sections'])
+        new_path = f'{objects_path}{documents + update:032x}'
+        if isinstance(sidebar, SidebarView):
+            sidebar._addDocuments(json_sidebar['Sections'][section_num]['Path'], [(f'Added {update}.pdf', new_path, os.path.basename(new_path))])
+        else:
+            section = sidebar.sidebar.findChildren(Section)[section_num]
+            section.content.layout().addWidget(_DocumentButton(f'Added {update}', new_path))
+            section.sectionChanged.emit()
+        app.processEvents()
+    update_time = (time.perf_counter() - start) / updates
+    sidebar.close()
+    sidebar.deleteLater()
+    app.processEvents()
+
+    return {'sidebar': sidebar_class.__name__, 'documents': documents, 'startup_ms': startup_time * 1000,
+            'memory_mb': memory / 2 ** 20, 'update_ms': update_time * 1000}
+
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from PySide6.QtWidgets import QApplication
+from GUI.DLWindow import AppWindow
+import_time = time.perf_counter() - start
+app = QApplication(sys.argv)
+window = AppWindow()
+window.show()
+app.processEvents()
+first_paint_time = time.perf_counter() - start
+startup_modules = sorted(name for name in ('fitz', 'GUI.DLTabs', 'GUI.DLWidgets') if name in sys.modules)
+for tab_num in range(window.app_tabs.count()):
+    window.app_sidebar.setActiveTab(tab_num)
+    app.processEvents()
+app.aboutToQuit.emit()
+print(json.dumps({'import_sec': import_time, 'first_paint_sec': first_paint_time, 'startup_modules': startup_modules,
+                  'tab_sec': window.app_tabs.construction_times}))
+"""
+
+def peakMemory():
+    # peak resident set sizes in bytes of this process and of its finished children, the render workers among them
+    import resource
+    return {'self_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+            'children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2 ** 10}
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchSuite(tmp_dir, page_counts=(10, 100, 1000), sidebar_sizes=(100, 1000, 10000)):
+    # every measurement as one JSON document, results of two commits are compared key by key
+    results = {'commit': gitCommit(), 'platform': QApplication.instance().platformName(), 'cpus': os.cpu_count(),
+               'startup': benchStartup(tmp_dir), 'documents': []}
+    for page_count in page_counts:
+        for kind in ('text', 'images', 'mixed'):
+            path_to_pdf = syntheticPdf(os.path.join(tmp_dir, f'{kind}_{page_count}.pdf'), page_count,
+                                       images=kind == 'images', mixed=kind == 'mixed')
+            results['documents'].append({'kind': kind, 'pages': page_count,
+                                         'producer': benchProducer(path_to_pdf, consume=False),
+                                         'jump': benchJump(path_to_pdf) if page_count > 10 else None,
+                                         'viewer': benchViewer(path_to_pdf)})
+    results['sidebar'] = [benchSidebar(tmp_dir, sidebar_class, documents)
+                          for sidebar_class in (Sidebar, SidebarView) for documents in sidebar_sizes]
+    results['sidebar_store'] = [benchSidebarStore(tmp_dir, documents // 10) for documents in sidebar_sizes]
+    results['search'] = benchSearch(os.path.join(tmp_dir, 'search.sqlite3'), documents=500)
+    results['peak_memory'] = peakMemory()
+    return results
+
+def benchStartup(tmp_dir):
+    # cold start in a fresh interpreter: imports, first paint of the window, then every tab on its first activation
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    probe = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=tmp_dir, env=environment,
+                           capture_output=True, text=True, check=True)
+    return json.loads(probe.stdout.splitlines()[-1])
+
+def main(argv):
+    app = QApplication.instance() or QApplication(argv)
+    if '--trace' in argv:
+        # stage timings of one viewer run as a Chrome trace
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = benchViewer(syntheticPdf(os.path.join(tmp_dir, 'synthetic.pdf'), mixed=True),
+                                 trace_path=argv[argv.index('--trace') + 1])
+        print(f"traced: {result['first_page_ms']:.1f} ms to first page, {result['pages_per_sec']:.1f} pages/sec displayed")
+        return
+    if '--json' in argv:
+        # written to a file, fitz may print deprecation notices on stdout
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = benchSuite(tmp_dir)
+        with open(argv[argv.index('--json') + 1], 'wt') as _json:
+            json.dump(results, _json, indent=1)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        result = benchStartup(tmp_dir)
+        print(f"startup: {result['import_sec'] * 1000:.0f} ms imports, {result['first_paint_sec'] * 1000:.0f} ms to first paint, "
+              f"loaded at startup: {', '.join(result['startup_modules']) or 'none of fitz, DLTabs, DLWidgets'}")
+        for name, tab_time in result['tab_sec'].items():
+            print(f"tab {name}: {tab_time * 1000:.0f} ms on first activation")
+
+        path_to_pdf = argv[1] if len(argv) > 1 else syntheticPdf(os.path.join(tmp_dir, 'synthetic.pdf'))
+        for transport in _PageProducer.TRANSPORTS:
+            result = benchProducer(path_to_pdf, transport)
+            print(f"{result['transport']:>4}: {result['ms_per_page']:.2f} ms/page, "
+                  f"{result['gui_ms_per_page']:.2f} ms/page on GUI thread ({result['pages']} pages)")
+        for depth in (1, 2, 4, 8):
+            result = benchProducer(path_to_pdf, depth=depth)
+            print(f"depth {depth}: {result['pages_per_sec']:.1f} pages/sec, {result['shm_mb']:.1f} MB shared memory")
+        for workers in (1, 2, 4, 8):
+            result = benchProducer(path_to_pdf, workers=workers, consume=False)
+            print(f"workers {workers}: {result['total_sec']:.2f} sec full render, {result['pages_per_sec']:.1f} pages/sec")
+
+        second_pdf = syntheticPdf(os.path.join(tmp_dir, 'synthetic_second.pdf'), 20)
+        for persistent in (False, True):
+            result = benchSwitching((path_to_pdf, second_pdf), persistent)
+            print(f"{'persistent' if persistent else 'spawn-per-document'}: "
+                  f"{result['first_page_ms']:.1f} ms to first page after a switch")
+
+        result = benchJump(path_to_pdf)
+        print(f"jump: {result['visible_ms']:.1f} ms until visible pages after a fast drag, "
+              f"{result['stale_renders']:.1f} stale pages delivered meanwhile")
+
+        result = benchViewer(path_to_pdf)
+        print(f"viewer: {result['first_page_ms']:.1f} ms to first page, {result['pages_per_sec']:.1f} pages/sec displayed")
+
+        for sections in (10, 100, 1000):
+            result = benchSidebarStore(tmp_dir, sections)
+            print(f"sidebar {result['documents']} documents: {result['json_ms']:.2f} ms per json rewrite, "
+                  f"{result['store_ms']:.2f} ms per store update ({result['import_ms']:.0f} ms one-off import)")
+
+        for sidebar_class in (Sidebar, SidebarView):
+            for documents in (100, 1000, 10000):
+                result = benchSidebar(tmp_dir, sidebar_class, documents)
+                print(f"{result['sidebar']} {result['documents']} documents: {result['startup_ms']:.0f} ms to first paint, "
+                      f"{result['memory_mb']:.1f} MB")
+
+        result = benchSearch(os.path.join(tmp_dir, 'search.sqlite3'))
+        print(f"search: {result['query_ms']:.2f} ms median query, {result['query_p95_ms']:.2f} ms p95 "
+              f"over {result['pages']} pages of {result['documents']} documents "
+              f"({result['build_sec']:.1f} sec to index, {result['index_mb']:.0f} MB)")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,113 @@
+import os
+import re
+import sqlite3
+from collections import defaultdict
+
+from GUI.DLStorage import contentHash
+
+
+def extractText(path):
+    # runs in a worker process, which is the only place fitz gets imported
+    import fitz
+    # a document that cannot be read (damaged, encrypted, gone) is indexed as empty instead of stopping the pool
+    doc_hash, page_texts = None, []
+    try:
+        doc_hash = contentHash(path)
+        with fitz.open(path) as pdf:
+            page_texts = [page.get_text() for page in pdf]
+    except Exception:
+        page_texts = []
+    return path, doc_hash, page_texts
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+class SearchIndex:
+    RESULT_LIMIT = 200
+    PREFIX_LENGTH = 2
+    SNIPPET_LENGTH = 80
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (path TEXT PRIMARY KEY, doc_hash TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS documents_hash ON documents (doc_hash);
+        CREATE TABLE IF NOT EXISTS pages (doc_hash TEXT, page_num INTEGER, text TEXT, PRIMARY KEY (doc_hash, page_num)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS postings (term TEXT, doc_hash TEXT, pages TEXT, PRIMARY KEY (term, doc_hash)) WITHOUT ROWID;
+    """
+    def __init__(self, index_path):
+        # one instance per thread: the indexer writes, the viewer reads, WAL keeps them out of each other's way
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SearchIndex.SCHEMA)
+
+    def paths(self):
+        return {path for path, in self.connection.execute('SELECT path FROM documents')}
+    def isIndexed(self, doc_hash):
+        return self.connection.execute('SELECT 1 FROM pages WHERE doc_hash = ? LIMIT 1', (doc_hash,)).fetchone() is not None
+    def addDocument(self, path, doc_hash, page_texts):
+        # one posting per term and document listing its pages, shared by every path with the same content
+        term_pages = defaultdict(list)
+        for page_num, text in enumerate(page_texts):
+            for term in set(tokenize(text)):
+                term_pages[term].append(page_num)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO documents VALUES (?, ?)', (path, doc_hash))
+            if self.isIndexed(doc_hash):
+                return
+            # a document without pages keeps one empty row at page -1, so it counts as indexed and is not extracted again
+            page_rows = list(enumerate(page_texts)) or [(-1, '')]
+            self.connection.executemany('INSERT INTO pages VALUES (?, ?, ?)',
+                                        ((doc_hash, page_num, text) for page_num, text in page_rows))
+            self.connection.executemany('INSERT OR REPLACE INTO postings VALUES (?, ?, ?)',
+                                        ((term, doc_hash, ' '.join(map(str, pages)))
+                                         for term, pages in sorted(term_pages.items())))
+    def removeDocument(self, path):
+        with self.connection:
+            if not (row := self.connection.execute('SELECT doc_hash FROM documents WHERE path = ?', (path,)).fetchone()):
+                return
+            self.connection.execute('DELETE FROM documents WHERE path = ?', (path,))
+            if self.connection.execute('SELECT 1 FROM documents WHERE doc_hash = ?', row).fetchone():
+                return
+            self.connection.execute('DELETE FROM pages WHERE doc_hash = ?', row)
+            self.connection.execute('DELETE FROM postings WHERE doc_hash = ?', row)
+    def query(self, text, limit=RESULT_LIMIT):
+        # every term must occur on the page, the last one may be incomplete while typing
+        if not (terms := tokenize(text)):
+            return []
+        hits = None
+        for term_num, term in enumerate(terms):
+            if term_num == len(terms) - 1 and len(term) >= SearchIndex.PREFIX_LENGTH:
+                rows = self.connection.execute('SELECT doc_hash, pages FROM postings WHERE term >= ? AND term < ?',
+                                               (term, term + '\uffff'))
+            else:
+                rows = self.connection.execute('SELECT doc_hash, pages FROM postings WHERE term = ?', (term,))
+            term_hits = defaultdict(set)
+            for doc_hash, pages in rows:
+                if hits is None or doc_hash in hits:
+                    term_hits[doc_hash].update(map(int, pages.split()))
+            if hits is not None:
+                term_hits = {doc_hash: pages & hits[doc_hash] for doc_hash, pages in term_hits.items()}
+            hits = {doc_hash: pages for doc_hash, pages in term_hits.items() if pages}
+            if not hits:
+                return []
+
+        results = []
+        for doc_hash in sorted(hits):
+            path, = self.connection.execute('SELECT MIN(path) FROM documents WHERE doc_hash = ?', (doc_hash,)).fetchone()
+            for page_num in sorted(hits[doc_hash]):
+                if len(results) == limit:
+                    return results
+                page_text, = self.connection.execute('SELECT text FROM pages WHERE doc_hash = ? AND page_num = ?',
+                                                     (doc_hash, page_num)).fetchone()
+                results.append((path, page_num, SearchIndex._snippet(page_text, terms)))
+        return results
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _snippet(page_text, terms):
+        page_text = ' '.join(page_text.split())
+        match = re.search(re.escape(terms[0]), page_text, re.IGNORECASE)
+        start = max(0, match.start() - SearchIndex.SNIPPET_LENGTH // 4) if match else 0
+        return page_text[start:start + SearchIndex.SNIPPET_LENGTH]
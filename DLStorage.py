@@ -0,0 +1,355 @@
+import hashlib
+import ctypes
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # no reflinks outside of Linux
+    fcntl = None
+
+FICLONE = 0x40049409
+
+
+def contentHash(path, chunk_size=2 ** 20):
+    # stored documents are already named by their blake2s-16 digest
+    file_name = os.path.basename(path)
+    if re.fullmatch(r'[0-9a-f]{32}', file_name):
+        return file_name
+    file_hash = hashlib.blake2s(digest_size=16)
+    with open(path, 'rb') as _file:
+        while chunk := _file.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def importDocument(source_path, target_dir, stored_path=None, chunk_size=2 ** 20):
+    # one pass over the source: chunks are hashed while written to a temporary file that is renamed to its hash
+    # stored_path(doc_hash) names an already stored copy, which is linked instead of kept twice
+    os.makedirs(target_dir, exist_ok=True)
+    source_name = os.path.basename(source_path)
+    if stored_path and re.fullmatch(r'[0-9a-f]{32}', source_name) and stored_path(source_name):
+        return _linkDocument(stored_path(source_name), target_dir), source_name
+
+    file_hash = hashlib.blake2s(digest_size=16)
+    temp_fd, temp_path = tempfile.mkstemp(dir=target_dir, suffix='.tmp')
+    try:
+        with open(source_path, 'rb') as _source, os.fdopen(temp_fd, 'wb') as _temp:
+            copied = _reflink(_source, _temp)
+            while chunk := _source.read(chunk_size):
+                file_hash.update(chunk)
+                if not copied:
+                    _temp.write(chunk)
+        doc_hash = file_hash.hexdigest()
+        target_path = os.path.join(target_dir, doc_hash)
+        if os.path.exists(target_path):
+            return target_path, doc_hash
+        if stored_path and (existing_path := stored_path(doc_hash)) and _link(existing_path, target_path):
+            return target_path, doc_hash
+        os.replace(temp_path, target_path)
+        return target_path, doc_hash
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _reflink(source_file, target_file):
+    # a copy-on-write clone shares the data blocks, the source is still read once for the hash
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        return True
+    except OSError:
+        return False
+def _link(existing_path, target_path):
+    try:
+        os.link(existing_path, target_path)
+        return True
+    except OSError:
+        return False
+def _linkDocument(existing_path, target_dir):
+    target_path = os.path.join(target_dir, os.path.basename(existing_path))
+    if not os.path.exists(target_path) and not _link(existing_path, target_path):
+        shutil.copyfile(existing_path, target_path)
+    return target_path
+
+class ObjectStore:
+    # every document is stored once as <objects_path>/<hash>, sections only reference it
+    def __init__(self, objects_path):
+        self.objects_path = objects_path
+        os.makedirs(self.objects_path, exist_ok=True)
+        # the hash index is read once, lookups afterwards never touch the disk
+        self.objects = {file_name: os.path.join(self.objects_path, file_name) for file_name in os.listdir(self.objects_path)
+                        if re.fullmatch(r'[0-9a-f]{32}', file_name)}
+        self.references = defaultdict(int)
+
+    def contains(self, doc_hash):
+        return doc_hash in self.objects
+    def objectPath(self, doc_hash):
+        return self.objects.get(doc_hash)
+    def isObject(self, path):
+        return os.path.normpath(os.path.dirname(path)) == os.path.normpath(self.objects_path)
+    def importDocument(self, source_path):
+        _, doc_hash = importDocument(source_path, self.objects_path, self.objectPath)
+        return self.addObject(doc_hash), doc_hash
+    def addObject(self, doc_hash):
+        # records an object written into objects_path by someone else, e.g. a bulk import
+        self.objects[doc_hash] = os.path.join(self.objects_path, doc_hash)
+        return self.objects[doc_hash]
+    def retain(self, doc_hash):
+        self.references[doc_hash] += 1
+    def release(self, doc_hash):
+        # the object goes once the last section referencing it lets go
+        self.references[doc_hash] -= 1
+        if self.references[doc_hash] > 0:
+            return
+        del self.references[doc_hash]
+        if object_path := self.objects.pop(doc_hash, None):
+            try:
+                os.remove(object_path)
+            except FileNotFoundError:
+                pass
+
+def migrateToObjects(sidebar_store, object_store):
+    # moves per-section copies into the object store, copies of the same content collapse into one object
+    migrated = 0
+    for image in sidebar_store.load()['Sections']:
+        for path in image['Content'].values():
+            if object_store.isObject(path):
+                continue
+            doc_hash = os.path.basename(path)
+            if os.path.exists(path):
+                if object_store.contains(doc_hash):
+                    os.remove(path)
+                else:
+                    os.replace(path, os.path.join(object_store.objects_path, doc_hash))
+                    object_store.addObject(doc_hash)
+            if object_store.contains(doc_hash):
+                sidebar_store.relocate(path, object_store.objectPath(doc_hash))
+                migrated += 1
+    return migrated
+
+class RenderCache:
+    CACHE_LIMIT = 2 * 2 ** 30
+    HEADER = struct.Struct('<4sIIIB')  # magic, width, height, stride, alpha
+    MAGIC = b'DLRC'
+    THUMBNAIL_CHUNK = 8
+    THUMBNAIL_HEADER = struct.Struct('<4sI')  # magic, count
+    THUMBNAIL_ENTRY = struct.Struct('<II')  # offset, length
+    THUMBNAIL_MAGIC = b'DLTH'
+    def __init__(self, cache_path, cache_limit=CACHE_LIMIT):
+        self.cache_path = cache_path
+        self.cache_limit = cache_limit
+        # running size of the entries shared by every process writing them, -1 until the first scan
+        self.cache_size = multiprocessing.Value(ctypes.c_longlong, -1)
+        self.evict_lock = multiprocessing.Lock()
+
+    def entryPath(self, doc_hash, page_num, scale):
+        return os.path.join(self.cache_path, doc_hash, f'{page_num}@{scale:g}.raw')
+    def hasPage(self, doc_hash, page_num, scale):
+        return os.path.exists(self.entryPath(doc_hash, page_num, scale))
+    def read(self, doc_hash, page_num, scale):
+        entry_path = self.entryPath(doc_hash, page_num, scale)
+        try:
+            with open(entry_path, 'rb') as _entry:
+                cache_map = mmap.mmap(_entry.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        if len(cache_map) < RenderCache.HEADER.size:
+            cache_map.close()
+            return None
+        magic, width, height, stride, alpha = RenderCache.HEADER.unpack_from(cache_map)
+        if magic != RenderCache.MAGIC or len(cache_map) < RenderCache.HEADER.size + stride * height:
+            cache_map.close()
+            return None
+
+        os.utime(entry_path)  # mtime is the recency mark for eviction
+        return cache_map, width, height, stride, alpha
+    def write(self, doc_hash, page_num, scale, width, height, stride, alpha, samples):
+        entry_path = self.entryPath(doc_hash, page_num, scale)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_path = f'{entry_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as _entry:
+            _entry.write(RenderCache.HEADER.pack(RenderCache.MAGIC, width, height, stride, alpha))
+            _entry.write(samples)
+        self._replace(temp_path, entry_path)
+    def thumbnailPath(self, doc_hash, chunk):
+        return os.path.join(self.cache_path, doc_hash, f'thumbs_{chunk}.bin')
+    def hasThumbnails(self, doc_hash, chunk):
+        return os.path.exists(self.thumbnailPath(doc_hash, chunk))
+    def readThumbnail(self, doc_hash, page_num):
+        # encoded bytes of one thumbnail, a chunk of consecutive pages shares a file with an offset table
+        chunk, entry_num = divmod(page_num, RenderCache.THUMBNAIL_CHUNK)
+        try:
+            with open(self.thumbnailPath(doc_hash, chunk), 'rb') as _entry:
+                magic, count = RenderCache.THUMBNAIL_HEADER.unpack(_entry.read(RenderCache.THUMBNAIL_HEADER.size))
+                if magic != RenderCache.THUMBNAIL_MAGIC or entry_num >= count:
+                    return None
+                _entry.seek(RenderCache.THUMBNAIL_HEADER.size + entry_num * RenderCache.THUMBNAIL_ENTRY.size)
+                offset, length = RenderCache.THUMBNAIL_ENTRY.unpack(_entry.read(RenderCache.THUMBNAIL_ENTRY.size))
+                _entry.seek(offset)
+                return _entry.read(length)
+        except (FileNotFoundError, struct.error):
+            return None
+    def writeThumbnails(self, doc_hash, chunk, images):
+        entry_path = self.thumbnailPath(doc_hash, chunk)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        temp_path = f'{entry_path}.{os.getpid()}.tmp'
+        offset = RenderCache.THUMBNAIL_HEADER.size + len(images) * RenderCache.THUMBNAIL_ENTRY.size
+        with open(temp_path, 'wb') as _entry:
+            _entry.write(RenderCache.THUMBNAIL_HEADER.pack(RenderCache.THUMBNAIL_MAGIC, len(images)))
+            for image in images:
+                _entry.write(RenderCache.THUMBNAIL_ENTRY.pack(offset, len(image)))
+                offset += len(image)
+            for image in images:
+                _entry.write(image)
+        self._replace(temp_path, entry_path)
+    def readMeta(self, doc_hash):
+        # per-document metadata (page sizes, outline) in one small json next to the page entries
+        try:
+            with open(os.path.join(self.cache_path, doc_hash, 'meta.json')) as _meta:
+                return json.load(_meta)
+        except (FileNotFoundError, ValueError):
+            return {}
+    def writeMeta(self, doc_hash, **fields):
+        meta_path = os.path.join(self.cache_path, doc_hash, 'meta.json')
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = self.readMeta(doc_hash) | fields
+        temp_path = f'{meta_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as _meta:
+            json.dump(meta, _meta)
+        os.replace(temp_path, meta_path)
+    def _replace(self, temp_path, entry_path):
+        # the limit is kept at write time, whoever writes past it evicts unless another process already does
+        try:
+            size_change = os.path.getsize(temp_path) - os.path.getsize(entry_path)
+        except FileNotFoundError:
+            size_change = os.path.getsize(temp_path)
+        os.replace(temp_path, entry_path)
+        with self.cache_size.get_lock():
+            if self.cache_size.value >= 0:
+                self.cache_size.value += size_change
+            cache_size = self.cache_size.value
+        if (cache_size < 0 or cache_size > self.cache_limit) and self.evict_lock.acquire(block=False):
+            try:
+                self.evict()
+            finally:
+                self.evict_lock.release()
+    def evict(self):
+        # meta.json files are counted by the scan only, a few hundred bytes per document
+        entries, cache_size = [], 0
+        for dir_path, _, file_names in os.walk(self.cache_path):
+            for file_name in file_names:
+                entry_path = os.path.join(dir_path, file_name)
+                try:
+                    entry_stat = os.stat(entry_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+                cache_size += entry_stat.st_size
+        for _, entry_size, entry_path in sorted(entries):
+            if cache_size <= self.cache_limit:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            cache_size -= entry_size
+        with self.cache_size.get_lock():
+            self.cache_size.value = cache_size
+        return cache_size
+
+class SidebarStore:
+    # sections and their documents as rows, every mutation touches only its own records in one transaction
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS sections (path TEXT PRIMARY KEY, label TEXT NOT NULL, position INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS documents (section_path TEXT NOT NULL, name TEXT NOT NULL, path TEXT NOT NULL,
+                                              position INTEGER NOT NULL, PRIMARY KEY (section_path, name));
+    """
+    def __init__(self, store_path, json_path=None):
+        os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+        self.connection = sqlite3.connect(store_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SidebarStore.SCHEMA)
+        if json_path and os.path.exists(json_path) and not self._meta('json_imported'):
+            self.importJson(json_path)
+
+    def _meta(self, key):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+    def _nextPosition(self):
+        return self.connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM sections').fetchone()[0]
+    def _insertSection(self, image, position):
+        self.connection.execute('INSERT INTO sections VALUES (?, ?, ?)', (image['Path'], image['Label'], position))
+        self._insertContent(image['Path'], image['Content'])
+    def _insertContent(self, section_path, content, first_position=0):
+        self.connection.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)',
+                                    ((section_path, name, path, first_position + position)
+                                     for position, (name, path) in enumerate(content.items())))
+
+    def importJson(self, json_path):
+        # sidebar.json is read once, the file itself is left in place untouched
+        with open(json_path) as _json:
+            json_sidebar = json.load(_json)
+        with self.connection:
+            first_position = self._nextPosition()
+            for position, image in enumerate(json_sidebar['Sections']):
+                self._insertSection(image, first_position + position)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('json_imported', ?)", (json_path,))
+    def load(self):
+        # the same {'Sections': [{'Path', 'Label', 'Content'}]} image sidebar.json used to hold
+        sections = {path: {'Path': path, 'Label': label, 'Content': {}} for path, label in
+                    self.connection.execute('SELECT path, label FROM sections ORDER BY position')}
+        for section_path, name, path in self.connection.execute(
+                'SELECT section_path, name, path FROM documents ORDER BY section_path, position'):
+            sections[section_path]['Content'][name] = path
+        return {'Sections': list(sections.values())}
+    def addSection(self, image):
+        with self.connection:
+            self._insertSection(image, self._nextPosition())
+    def updateSection(self, image):
+        # only the label and the documents that differ from the stored rows are written
+        with self.connection:
+            self.connection.execute('UPDATE sections SET label = ? WHERE path = ?', (image['Label'], image['Path']))
+            stored = dict(self.connection.execute('SELECT name, path FROM documents WHERE section_path = ?', (image['Path'],)))
+            self.connection.executemany('DELETE FROM documents WHERE section_path = ? AND name = ?',
+                                        ((image['Path'], name) for name in stored.keys() - image['Content'].keys()))
+            added = {name: path for name, path in image['Content'].items() if stored.get(name) != path}
+            position, = self.connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM documents WHERE section_path = ?',
+                                                (image['Path'],)).fetchone()
+            self._insertContent(image['Path'], added, position)
+    def renameDocument(self, section_path, name, new_name):
+        # the row keeps its position, a rename is not a remove and add
+        with self.connection:
+            self.connection.execute('UPDATE documents SET name = ? WHERE section_path = ? AND name = ?',
+                                    (new_name, section_path, name))
+    def relocate(self, path, new_path):
+        with self.connection:
+            self.connection.execute('UPDATE documents SET path = ? WHERE path = ?', (new_path, path))
+    def removeSection(self, section_path):
+        with self.connection:
+            self.connection.execute('DELETE FROM documents WHERE section_path = ?', (section_path,))
+            self.connection.execute('DELETE FROM sections WHERE path = ?', (section_path,))
+    def close(self):
+        self.connection.close()
+
+
+def main(argv):
+    # python -m GUI.DLStorage <sidebar store> <objects dir>: moves existing per-section copies into the object store
+    sidebar_store = SidebarStore(argv[1])
+    migrated = migrateToObjects(sidebar_store, ObjectStore(argv[2]))
+    sidebar_store.close()
+    print(f'{migrated} document references moved to {argv[2]}')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,13 +1,27 @@
-from PySide6.QtWidgets import QWidget, QScrollArea, QHBoxLayout
+import os
+from functools import partial
+
+from PySide6.QtWidgets import QWidget, QScrollArea, QHBoxLayout, QVBoxLayout, QApplication
+from PySide6.QtGui import QKeySequence, QShortcut
 from PySide6.QtCore import Qt
 
-from GUI.DLWidgets import Sidebar, PdfView, Section
+from GUI.DLWidgets import SidebarView, PdfView, Section, SearchIndexer, SearchPanel, OutlinePanel, \
+    ThumbnailStrip
 
 
 class Documents(QWidget):
     DATA_PATH = './storage/sidebar/'
     JSON_PATH = './storage/sidebar.json'
+    STORE_PATH = './storage/sidebar.sqlite3'
+    OBJECTS_PATH = './storage/objects/'
+    CACHE_PATH = './storage/cache/'
+    INDEX_PATH = './storage/search.sqlite3'
     SIDEBAR_WIDTH = 300
+    OUTLINE_WIDTH = 220
+    THUMBNAIL_WIDTH = 180
+    OVERLAY_SHORTCUT = 'F12'
+    OVERLAY_ENV = 'DAILYLAB_OVERLAY'
+    TRACE_ENV = 'DAILYLAB_TRACE'
     def __init__(self):
         super().__init__()
 
@@ -17,11 +31,48 @@ class Documents(QWidget):
         self.layout().setContentsMargins(0,1,1,1)
         self.layout().setSpacing(1)
     def _setup(self):
-        self.tab_sidebar = Sidebar(Documents.DATA_PATH, Documents.JSON_PATH, Documents.SIDEBAR_WIDTH)
-        self.tab_viewer = PdfView(self.tab_sidebar.changeActiveDocument)
+        self.tab_sidebar = SidebarView(Documents.DATA_PATH, Documents.STORE_PATH, Documents.OBJECTS_PATH, Documents.SIDEBAR_WIDTH,
+                                       path_to_json=Documents.JSON_PATH)
+        self.tab_viewer = PdfView(self.tab_sidebar.changeActiveDocument, Documents.CACHE_PATH)
+        self.tab_sidebar.documentHovered.connect(self.tab_viewer.prefetchDocument)
+        self.tab_search = SearchPanel(Documents.INDEX_PATH, self.tab_sidebar.documentName, Documents.SIDEBAR_WIDTH)
+        self.tab_outline = OutlinePanel(Documents.OUTLINE_WIDTH)
+        self.tab_viewer.outlineChanged.connect(self.tab_outline.setOutline)
+        self.tab_outline.pageRequested.connect(self.tab_viewer.showPage)
+        self.tab_thumbnails = ThumbnailStrip(self.tab_viewer.render_cache, Documents.THUMBNAIL_WIDTH)
+        self.tab_viewer.documentLaidOut.connect(self.tab_thumbnails.setDocument)
+        self.tab_viewer.thumbnailsReady.connect(self.tab_thumbnails.updateChunk)
+        self.tab_thumbnails.pageRequested.connect(self.tab_viewer.showPage)
+        # DAILYLAB_OVERLAY=1 starts with the performance overlay shown, F12 toggles it at any time
+        # DAILYLAB_TRACE=<file> records the renderer pipeline and writes the trace there on quit
+        self.overlay_shortcut = QShortcut(QKeySequence(Documents.OVERLAY_SHORTCUT), self)
+        self.overlay_shortcut.activated.connect(self.tab_viewer.toggleOverlay)
+        self.tab_viewer.setOverlay(os.environ.get(Documents.OVERLAY_ENV, '0') not in ('', '0'))
+        if trace_path := os.environ.get(Documents.TRACE_ENV):
+            self.tab_viewer.setTracing(True)
+            QApplication.instance().aboutToQuit.connect(partial(self.tab_viewer.exportTrace, trace_path))
+
+        self.search_indexer = SearchIndexer(Documents.INDEX_PATH)
+        self.search_indexer.indexChanged.connect(self.tab_search.refresh)
+        self.tab_sidebar.documentAdded.connect(self.search_indexer.add)
+        self.tab_sidebar.documentRemoved.connect(self.search_indexer.remove)
+        self.tab_search.pageRequested.connect(self.tab_viewer.showDocument)
+        self.tab_search.resultsToggled.connect(self.tab_sidebar.setHidden)
+        self.search_indexer.sync(self.tab_sidebar.documentPaths())
+        self.search_indexer.start()
+        QApplication.instance().aboutToQuit.connect(self.search_indexer.stop)
+
+        self.navigation = QWidget()
+        self.navigation.setLayout(QVBoxLayout())
+        self.navigation.layout().setContentsMargins(0, 0, 0, 0)
+        self.navigation.layout().setSpacing(1)
+        self.navigation.layout().addWidget(self.tab_search)
+        self.navigation.layout().addWidget(self.tab_sidebar)
 
         self.setLayout(QHBoxLayout())
-        self.layout().addWidget(self.tab_sidebar)
+        self.layout().addWidget(self.navigation)
+        self.layout().addWidget(self.tab_outline)
+        self.layout().addWidget(self.tab_thumbnails)
         self.layout().addWidget(self.tab_viewer)
 
 class KanbanBoard(QScrollArea):
@@ -0,0 +1,35 @@
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    # stage timings collected as Chrome trace events, open the export in chrome://tracing or Perfetto
+    # call sites test tracer.enabled first, a disabled tracer costs one attribute lookup per stage
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+    def span(self, name, start_ns, **args):
+        # a complete event from start_ns until now, perf_counter_ns is the same clock in every process
+        end_ns = time.perf_counter_ns()
+        self.events.append({'name': name, 'ph': 'X', 'ts': start_ns / 1000, 'dur': (end_ns - start_ns) / 1000,
+                            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+    def counter(self, name, **values):
+        self.events.append({'name': name, 'ph': 'C', 'ts': time.perf_counter_ns() / 1000, 'pid': os.getpid(),
+                            'args': values})
+    def extend(self, events):
+        self.events.extend(events)
+    def flush(self):
+        events, self.events = self.events, []
+        return events
+    def export(self, trace_path):
+        with open(trace_path, 'wt') as _trace:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, _trace)
+
+
+# one per process, render workers ship theirs to the viewer process
+TRACER = Tracer()
@@ -1,30 +1,113 @@
 import ctypes
-import hashlib
-import json
+import heapq
+import math
+from bisect import bisect_right
 import multiprocessing
 import os
+import queue
 import shutil
+import threading
+import time
+from collections import defaultdict, deque, OrderedDict
 from functools import partial
-from multiprocessing import shared_memory, Pipe, Event
-
-import fitz
-from PySide6.QtCore import Qt, QObject, QPoint, QStandardPaths, Signal, QPropertyAnimation, QEasingCurve, QTimer
-from PySide6.QtGui import QIcon, QImage, QPixmap
+from multiprocessing import shared_memory, Pipe
+from multiprocessing.connection import wait
+from multiprocessing.pool import ThreadPool
+
+from PySide6.QtCore import Qt, QObject, QPoint, QStandardPaths, Signal, QPropertyAnimation, QEasingCurve, QTimer, \
+    QThread, QAbstractListModel, QModelIndex, QPersistentModelIndex, QRect, QSize
+from PySide6.QtGui import QIcon, QImage, QPixmap, QColor, QPainter, QTransform, QFont, QStandardItem, \
+    QStandardItemModel
 from PySide6.QtWidgets import QWidget, QScrollArea, QVBoxLayout, QPushButton, \
-    QHBoxLayout, QGridLayout, QLabel, QFileDialog, QLineEdit, QGraphicsView, QGraphicsScene, QButtonGroup
+    QHBoxLayout, QGridLayout, QLabel, QFileDialog, QLineEdit, QGraphicsView, QGraphicsScene, QButtonGroup, QApplication, \
+    QGraphicsPixmapItem, QListWidget, QListWidgetItem, QTreeWidget, QTreeWidgetItem, QListView, QProgressBar, \
+    QTreeView, QStyledItemDelegate, QStyle, QMenu
 from GUI.DLInterface import ARRInterface
-
-class Sidebar(QScrollArea):
+from GUI.DLSearch import SearchIndex, extractText
+from GUI.DLTrace import TRACER
+from GUI.DLStorage import ObjectStore, RenderCache, SidebarStore, contentHash, importDocument, migrateToObjects
+
+def _freePostfix(names):
+    # the lowest free number among Section_<n> names
+    postfix_set = {int(name.split('_')[-1]) for name in names if name.startswith('Section_') and name.split('_')[-1].isdigit()}
+    return min(set(range(len(postfix_set) + 1)) - postfix_set)
+def _uniqueName(name, names):
+    unique_name, copy_num = name, 1
+    while unique_name in names:
+        copy_num += 1
+        unique_name = f'{name} ({copy_num})'
+    return unique_name
+def _startImport(parent, object_store, progress, finished):
+    # every pdf below the chosen folder is copied in the background, None when the dialog is cancelled
+    folder_path = QFileDialog.getExistingDirectory(parent=parent, caption='Select Folder',
+        dir=QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DownloadLocation))
+    if not folder_path:
+        return None
+    source_paths = sorted(os.path.join(root, file_name) for root, _, file_names in os.walk(folder_path)
+                          for file_name in file_names if file_name.lower().endswith('.pdf'))
+    importer = DocumentImporter(source_paths, object_store)
+    importer.progressChanged.connect(progress.setProgress)
+    importer.importFinished.connect(finished)
+    progress.cancel_btn.clicked.connect(importer.cancel)
+    progress.setProgress(0, len(source_paths))
+    progress.show()
+    importer.start()
+    return importer
+def _finishImport(importer, object_store, progress, imported):
+    importer.wait()
+    progress.cancel_btn.clicked.disconnect(importer.cancel)
+    progress.hide()
+    for _, _, file_hash in imported:
+        object_store.addObject(file_hash)
+
+class _SidebarDocuments:
+    # storage side shared by both sidebars: the sections in the sidebar store, the documents in the object store
+    def _openStores(self, path_to_data, path_to_store, path_to_objects, path_to_json=None):
+        self.data_path = path_to_data
+        self.store_path = path_to_store
+        # an existing sidebar.json is imported into the store on first start, per-section copies move to the objects
+        self.sidebar_store = SidebarStore(self.store_path, path_to_json)
+        self.object_store = ObjectStore(path_to_objects)
+        migrateToObjects(self.sidebar_store, self.object_store)
+        self.json_sidebar = self.sidebar_store.load()
+        for path in self.documentPaths():
+            self.object_store.retain(os.path.basename(path))
+    def _newSectionImage(self):
+        # a section path only names the section in the store, its documents live in the object store
+        sections = self.json_sidebar['Sections']
+        section_label = f"Section_{_freePostfix(record['Label'] for record in sections)}"
+        section_dir = self.data_path + f"Section_{_freePostfix(record['Path'].split('/')[-1] for record in sections)}"
+        return {'Path': section_dir, 'Label': section_label, 'Content': {}}
+    def _retainDocuments(self, paths):
+        for path in paths:
+            self.object_store.retain(os.path.basename(path))
+            self.documentAdded.emit(path)
+    def _releaseDocuments(self, paths):
+        for path in paths:
+            # sections share the object, it is only gone with its last reference
+            self.object_store.release(os.path.basename(path))
+            if not self.object_store.contains(os.path.basename(path)):
+                self.documentRemoved.emit(path)
+
+    def documentPaths(self):
+        return [path for image in self.json_sidebar['Sections'] for path in image['Content'].values()]
+    def documentName(self, path):
+        for image in self.json_sidebar['Sections']:
+            for name, _path in image['Content'].items():
+                if _path == path:
+                    return name
+        return os.path.basename(path)
+class Sidebar(QScrollArea, _SidebarDocuments):
     changeActiveDocument = Signal(str)
-    def __init__(self, path_to_data, path_to_json, width=None, height=None):
+    documentHovered = Signal(str)
+    documentAdded = Signal(str)
+    documentRemoved = Signal(str)
+    def __init__(self, path_to_data, path_to_store, path_to_objects, width=None, height=None, path_to_json=None):
         super().__init__()
-        self.data_path = path_to_data
-        self.json_path = path_to_json
         self.fixed_width = width
         self.fixed_height = height
 
-        with open(self.json_path) as _json:
-            self.json_sidebar = json.load(_json)
+        self._openStores(path_to_data, path_to_store, path_to_objects, path_to_json)
         self.arr_submenu = ARRSubmenu()
         self.documents = QButtonGroup()
         self.documents.idClicked.connect(self.setActiveDocument)
@@ -102,42 +185,22 @@ class Sidebar(QScrollArea):
         y_offset = self.viewport().height() - self.add_section.height()
         self.add_section.move(x_offset, y_offset)
     def _createSection(self, section_label=None, section_content=None, section_dir=None, mode='Exists'):
-        if section_label is None:
-            postfix_set = {int(record['Label'].split('_')[-1]) for record in self.json_sidebar['Sections'] if
-                           record['Label'].startswith('Section_')}
-            free_postfix: int
-            if postfix_set:
-                full_set = set(range(max(postfix_set) + 1))
-                free_postfix = min(full_set - postfix_set) if full_set - postfix_set else max(postfix_set) + 1
-            else:
-                free_postfix = 0
-            section_label = f'Section_{free_postfix}'
-        if section_content is None:
-            section_content = {}
-        if section_dir is None:
-            postfix_set = {int(record['Path'].split('/')[-1].split('_')[-1]) for record in self.json_sidebar['Sections']
-                           if record['Path'].split('/')[-1].startswith('Section_')}
-            free_postfix: int
-            if postfix_set:
-                full_set = set(range(max(postfix_set) + 1))
-                free_postfix = min(full_set - postfix_set) if full_set - postfix_set else max(postfix_set) + 1
-            else:
-                free_postfix = 0
-            section_dir = self.data_path + f'Section_{free_postfix}'
+        if mode == 'New':
+            image = self._newSectionImage()
+            section_label, section_content, section_dir = image['Label'], image['Content'], image['Path']
 
-        section = Section(self.arr_submenu, section_label, section_content, section_dir)
+        section = Section(self.arr_submenu, section_label, section_content, section_dir, self.object_store)
         section.sectionChanged.connect(self.updateSection)
         self.sidebar.layout().addWidget(section)
 
         for document in section.findChildren(_DocumentButton):
             self.documents.addButton(document)
+            document.hovered.connect(self.documentHovered)
 
         if mode == 'New':
-            os.mkdir(section.section_dir)
             image = section.getSectionImage()
             self.json_sidebar['Sections'].append(image)
-            with open(self.json_path, 'wt') as _json:
-                json.dump(self.json_sidebar, _json)
+            self.sidebar_store.addSection(image)
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -170,28 +233,29 @@ class Sidebar(QScrollArea):
 
         # Commit changes
         if self.sidebar.layout().indexOf(section) == -1:
-            shutil.rmtree(section.section_dir)
+            # sections created before the object store may still have their own directory
+            shutil.rmtree(section.section_dir, ignore_errors=True)
             del self.json_sidebar['Sections'][recent_image_index]
+            self.sidebar_store.removeSection(current_image['Path'])
+            self._releaseDocuments(recent_content)
         else:
             self.json_sidebar['Sections'][recent_image_index] = current_image
-            if removed_content:
-                _removed = removed_content.pop()
-                for protocol in section.findChildren(_DocumentButton):
-                    if protocol.path == _removed:
-                        self.documents.removeButton(protocol)
-                        break
-            elif added_content:
-                _added = added_content.pop()
-                for protocol in section.findChildren(_DocumentButton):
-                    if protocol.path == _added:
-                        self.documents.addButton(protocol)
-                        break
-        with open(self.json_path, 'wt') as _json:
-            json.dump(self.json_sidebar, _json)
+            self.sidebar_store.updateSection(current_image)
+            # a bulk import arrives as one change with many documents
+            protocols = {protocol.path: protocol for protocol in section.findChildren(_DocumentButton)}
+            for _removed in removed_content:
+                if _removed in protocols:
+                    self.documents.removeButton(protocols[_removed])
+            self._releaseDocuments(removed_content)
+            for _added in added_content:
+                if _added in protocols:
+                    self.documents.addButton(protocols[_added])
+                    protocols[_added].hovered.connect(self.documentHovered)
+            self._retainDocuments(added_content)
 class Section(QWidget):
     sectionChanged = Signal()
     # подтягивать arr submenu в classmethod а не ссылкой
-    def __init__(self, arr_submenu, section_label: str, section_content: dict, section_dir: str):
+    def __init__(self, arr_submenu, section_label: str, section_content: dict, section_dir: str, object_store=None):
         super().__init__()
         self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
 
@@ -199,6 +263,9 @@ class Section(QWidget):
         self.section_label = section_label
         self.section_content = section_content
         self.section_dir = section_dir
+        self.section_hashes = {os.path.basename(path) for path in section_content.values()}
+        self.object_store = object_store
+        self.importer = None
 
         self._setContent()
         self._adjustLayout()
@@ -212,8 +279,10 @@ class Section(QWidget):
         self.setLayout(QVBoxLayout())
 
         self.header = _SectionHeader(self.section_label)
+        self.progress = _ImportProgress()
         self.content = _DocumentContent(self.section_content)
         self.layout().addWidget(self.header)
+        self.layout().addWidget(self.progress)
         self.layout().addWidget(self.content)
 
         self._setConnections()
@@ -222,19 +291,21 @@ class Section(QWidget):
         self.layout().setSpacing(0)
     def _setConnections(self):
         self.header.toggle_btn.clicked.connect(self.toggleContent)
-        self.header.submenu_btn.clicked.connect(partial(self.arr_submenu.call, self.header.submenu_btn, self.content, self.header.label, self))
+        self.header.submenu_btn.clicked.connect(partial(self.arr_submenu.call, self.header.submenu_btn, self, self.header.label, self))
 
         #for document in self.content.findChildren(_DocumentButton):
         #    document.settings.clicked.connect(partial(self.arr_submenu.call, document.settings, None, document, document))
 
         self.arr_submenu.changeReceiver.connect(self.updateSection)
-    def updateSection(self, action, receiver: ARRInterface):
-        print(action, receiver)
-        print('horhe')
+    def updateSection(self, action=None, receiver: ARRInterface = None):
+        # the submenu signal reaches every section, only the one owning the receiver acts on it
+        if receiver is not None and receiver is not self and not self.isAncestorOf(receiver):
+            return
         match action:
             case 'Add':
-                receiver.add()
                 receiver.createDocument()
+            case 'Import':
+                receiver.importFolder()
             case 'Rename':
                 receiver.setEnabled(True)
             case 'Remove':
@@ -246,7 +317,9 @@ class Section(QWidget):
         for protocol in self.content.findChildren(_DocumentButton):
             protocol.name = protocol.text()
             self.section_content[protocol.name] = protocol.path
-        #self.sectionChanged.emit()
+        self.section_hashes = {os.path.basename(path) for path in self.section_content.values()}
+        if action == 'Remove':
+            self.sectionChanged.emit()
     def getSectionImage(self):
         return {'Path': self.section_dir, 'Label': self.section_label, 'Content': self.section_content}
 
@@ -258,28 +331,38 @@ class Section(QWidget):
             dir=QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DownloadLocation),
             filter='PDF (*.pdf)')[0]
         if recent_path:
-            with open(recent_path, 'rb') as _file:
-                hashable_file = _file.read()
-            file_hash = hashlib.blake2s(hashable_file, digest_size = 16).hexdigest()
+            # streamed into the object store under its hash, content already stored is not copied again
+            new_path, file_hash = self.object_store.importDocument(recent_path)
 
             if not self.isDocumentExists(file_hash):
                 file_name = recent_path.split('/')[-1].split('.')[0]
-                new_path = self.section_dir + '/' + file_hash
 
                 protocol = _DocumentButton(file_name, new_path)
-                protocol.settings.clicked.connect(partial(self.callARRSubmenu, protocol.settings, protocol, protocol))
+                protocol.settings.clicked.connect(partial(self.arr_submenu.call, protocol.settings, None, protocol, protocol))
 
-                add_btnIndex = self.content.layout().indexOf(self.content.add_btn)
-                self.content.layout().insertWidget(add_btnIndex, protocol)
-
-                shutil.copyfile(recent_path, new_path)
+                self.content.layout().addWidget(protocol)
                 self.sectionChanged.emit()
+    def importFolder(self):
+        if self.importer is None:
+            self.importer = _startImport(self, self.object_store, self.progress, self._addDocuments)
+    def _addDocuments(self, imported):
+        # the whole batch reaches the sidebar and its store as one change
+        _finishImport(self.importer, self.object_store, self.progress, imported)
+        self.importer = None
+        for source_path, new_path, file_hash in imported:
+            if self.isDocumentExists(file_hash):
+                continue
+            names = {protocol.text() for protocol in self.content.findChildren(_DocumentButton)}
+            name = _uniqueName(os.path.basename(source_path).rsplit('.', 1)[0], names)
+
+            protocol = _DocumentButton(name, new_path)
+            protocol.settings.clicked.connect(partial(self.arr_submenu.call, protocol.settings, None, protocol, protocol))
+            self.content.layout().addWidget(protocol)
+            self.section_hashes.add(file_hash)
+        self.updateSection()
+        self.sectionChanged.emit()
     def isDocumentExists(self, file_hash):
-        for path in self.section_content.values():
-            _hash = path.split('/')[-1]
-            if file_hash == _hash:
-                return True
-        return False
+        return file_hash in self.section_hashes
 
 class _SectionHeader(QWidget):
     HEADER_HEIGHT = 40
@@ -327,6 +410,28 @@ class _SectionHeader(QWidget):
     def _adjustLayout(self):
         self.layout().setContentsMargins(0,0,0,0)
         self.layout().setSpacing(0)
+class _ImportProgress(QWidget):
+    def __init__(self):
+        super().__init__()
+        self._setContent()
+        self._adjustLayout()
+        self.hide()
+    def _setContent(self):
+        self.setLayout(QHBoxLayout())
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.cancel_btn = QPushButton('Cancel')
+
+        self.layout().addWidget(self.progress_bar)
+        self.layout().addWidget(self.cancel_btn)
+    def _adjustLayout(self):
+        self.layout().setContentsMargins(0, 5, 0, 5)
+        self.layout().setSpacing(5)
+
+    def setProgress(self, done, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
 class _DocumentContent(QWidget):
     def __init__(self, documents: dict):
         super().__init__()
@@ -357,6 +462,7 @@ class _DocumentContent(QWidget):
         self.toggle_animation.setEndValue(end_value)
         self.toggle_animation.start()
 class _DocumentButton(QPushButton, ARRInterface):
+    hovered = Signal(str)
     BTN_HEIGHT = 40
     def __init__(self, name, path):
         super().__init__()
@@ -409,9 +515,13 @@ class _DocumentButton(QPushButton, ARRInterface):
     def enterEvent(self, event):
         super().enterEvent(event)
         self.settings.show()
+        self.hovered.emit(self.path)
     def leaveEvent(self, event):
         super().leaveEvent(event)
         self.settings.hide()
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        self.hovered.emit(self.path)
 
 class ARRSubmenu(QWidget):
     changeReceiver = Signal(str, QObject)
@@ -420,7 +530,7 @@ class ARRSubmenu(QWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
         self.setWindowFlag(Qt.WindowType.Popup)
 
-        self.actions = ['Add', 'Rename', 'Remove']
+        self.actions = ['Add', 'Import', 'Rename', 'Remove']
         self.action_receiver : dict
 
         self._setup()
@@ -460,7 +570,8 @@ class ARRSubmenu(QWidget):
             self.findChild(QPushButton, action).hide()
         self.action_receiver = {action: None for action in self.actions}
     def _link(self, addable_receiver, renamable_receiver, removable_receiver):
-        self.action_receiver = dict(zip(self.actions, (addable_receiver, renamable_receiver, removable_receiver)))
+        # whatever documents can be added to also takes a folder of them
+        self.action_receiver = dict(zip(self.actions, (addable_receiver, addable_receiver, renamable_receiver, removable_receiver)))
         for action, receiver in self.action_receiver.items():
             if receiver:
                 self.findChild(QPushButton, action).show()
@@ -478,143 +589,1757 @@ class ARRSubmenu(QWidget):
         self.show()
 
 
+class SidebarView(QTreeView, _SidebarDocuments):
+    # the same sidebar over an item model: rows are painted by a delegate, no widget exists per document
+    changeActiveDocument = Signal(str)
+    documentHovered = Signal(str)
+    documentAdded = Signal(str)
+    documentRemoved = Signal(str)
+    def __init__(self, path_to_data, path_to_store, path_to_objects, width=None, height=None, path_to_json=None):
+        super().__init__()
+        self.fixed_width = width
+        self.fixed_height = height
+
+        self._openStores(path_to_data, path_to_store, path_to_objects, path_to_json)
+        self.sidebar_model = _SidebarModel(self.json_sidebar['Sections'])
+        self.importer = None
+        self.hovered_path = None
+
+        # styled before the model is set, a restyle relays every expanded row out again
+        self.setStyleSheet("""
+            QTreeView {
+                background-color: rgb(30, 30, 30);
+                border: none;
+                padding: 2px;
+            }
+            QLineEdit {
+                background-color: rgb(70, 70, 70);
+                font-family: 'Dylan';
+                border-radius: 5px;
+            }
+        """)
+        self._setup()
+        self._setViewportContent()
+    def _setup(self):
+        self.setModel(self.sidebar_model)
+        self.setItemDelegate(_SidebarDelegate(self))
+        self.setHeaderHidden(True)
+        self.setRootIsDecorated(False)
+        self.setIndentation(0)
+        self.setUniformRowHeights(True)
+        self.setExpandsOnDoubleClick(False)
+        self.setEditTriggers(QTreeView.EditTrigger.NoEditTriggers)
+        self.setSelectionMode(QTreeView.SelectionMode.NoSelection)
+        self.setFocusPolicy(Qt.FocusPolicy.TabFocus)
+        self.setVerticalScrollMode(QTreeView.ScrollMode.ScrollPerPixel)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.viewport().setAttribute(Qt.WidgetAttribute.WA_Hover)
+        self.setMouseTracking(True)
+        if self.fixed_width:
+            self.setFixedWidth(self.fixed_width)
+        if self.fixed_height:
+            self.setFixedHeight(self.fixed_height)
+        self.expandAll()
+
+        self.sidebar_model.sectionRenamed.connect(self._commitSection)
+        self.sidebar_model.documentRenamed.connect(self._renameDocument)
+    def _setViewportContent(self):
+        self.add_section = QPushButton(self)
+        self.add_section.setFixedHeight(50)
+        if self.fixed_width:
+            self.add_section.setFixedWidth(self.fixed_width)
+        self.add_section.setIcon(QIcon('./GUI/icons/Add.png'))
+        self.add_section.setStyleSheet("""
+            QPushButton {
+                background-color: rgb(40, 40, 40);
+                border: 1px solid rgba(255, 255, 255, 0.1);
+                border-radius: 5px;
+                margin: 5px;
+                qproperty-iconSize: 23px 23px;
+            }
+            QPushButton:hover {
+                background-color: rgba(100, 100, 100, 0.2);
+                color: rgb(255,255,255);
+            }
+        """)
+        self.add_section.clicked.connect(self.createSection)
+        self.setViewportMargins(0, 0, 0, self.add_section.height())
+
+        self.progress = _ImportProgress()
+        self.progress.setParent(self.viewport())
+    def _adjustViewport(self):
+        self.add_section.move(0, self.height() - self.add_section.height())
+        self.progress.setFixedWidth(self.viewport().width())
+        self.progress.move(0, self.viewport().height() - self.progress.sizeHint().height())
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._adjustViewport()
+    def mouseReleaseEvent(self, event):
+        index = self.indexAt(event.position().toPoint())
+        if event.button() != Qt.MouseButton.LeftButton or not index.isValid():
+            return super().mouseReleaseEvent(event)
+        is_section = not index.parent().isValid()
+        if _SidebarDelegate.submenuRect(self.visualRect(index), is_section).contains(event.position().toPoint()):
+            self._callSubmenu(index, event.globalPosition().toPoint())
+        elif is_section:
+            self.setExpanded(index, not self.isExpanded(index))
+        else:
+            self.setActiveDocument(index.data(_SidebarModel.PATH_ROLE))
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        index = self.indexAt(event.position().toPoint())
+        self._hover(index.data(_SidebarModel.PATH_ROLE) if index.isValid() and index.parent().isValid() else None)
+    def leaveEvent(self, event):
+        super().leaveEvent(event)
+        self.hovered_path = None
+    def currentChanged(self, current, previous):
+        # keyboard focus on a document is the same hint as the pointer resting on it
+        super().currentChanged(current, previous)
+        if current.isValid() and current.parent().isValid():
+            self.documentHovered.emit(current.data(_SidebarModel.PATH_ROLE))
+    def keyPressEvent(self, event):
+        index = self.currentIndex()
+        if event.key() not in (Qt.Key.Key_Return, Qt.Key.Key_Enter) or not index.isValid():
+            return super().keyPressEvent(event)
+        if index.parent().isValid():
+            self.setActiveDocument(index.data(_SidebarModel.PATH_ROLE))
+        else:
+            self.setExpanded(index, not self.isExpanded(index))
+    def _hover(self, path):
+        # emitted once per row entered, not for every move within it
+        if path != self.hovered_path:
+            self.hovered_path = path
+            if path:
+                self.documentHovered.emit(path)
+    def _callSubmenu(self, index, position):
+        # the same actions as ARRSubmenu: sections take documents, both can be renamed and removed
+        submenu = QMenu(self)
+        submenu.setStyleSheet("""
+            QMenu {
+                background-color: rgb(100,100,100);
+            }
+            QMenu::item {
+                background-color: rgb(70, 70, 70);
+                border-radius: 5px;
+                padding: 8px 30px;
+                margin: 1px;
+            }
+        """)
+        section_path = index.data(_SidebarModel.PATH_ROLE) if not index.parent().isValid() else None
+        if section_path:
+            submenu.addAction('Add', partial(self.createDocument, section_path))
+            submenu.addAction('Import', partial(self.importFolder, section_path))
+        submenu.addAction('Rename', partial(self._rename, QPersistentModelIndex(index)))
+        submenu.addAction('Remove', partial(self._remove, QPersistentModelIndex(index)))
+        submenu.exec(position)
+    def _rename(self, index):
+        if index.isValid():
+            self.edit(self.sidebar_model.index(index.row(), 0, index.parent()))
+
+    def _commitSection(self, section_row):
+        self.sidebar_store.updateSection(self.json_sidebar['Sections'][section_row])
+    def _renameDocument(self, section_row, name, new_name):
+        self.sidebar_store.renameDocument(self.json_sidebar['Sections'][section_row]['Path'], name, new_name)
+    def _remove(self, index):
+        if not index.isValid():
+            return
+        if index.parent().isValid():
+            section_row = index.parent().row()
+            removed = [self.sidebar_model.removeDocument(section_row, index.row())]
+            self._commitSection(section_row)
+        else:
+            image = self.sidebar_model.removeSection(index.row())
+            # sections created before the object store may still have their own directory
+            shutil.rmtree(image['Path'], ignore_errors=True)
+            self.sidebar_store.removeSection(image['Path'])
+            removed = list(image['Content'].values())
+        self._releaseDocuments(removed)
+    def _addDocuments(self, section_path, imported):
+        # a single document or a whole imported folder is one change of the section
+        if (section_row := self.sidebar_model.sectionRow(section_path)) is None:
+            return
+        image = self.json_sidebar['Sections'][section_row]
+        section_hashes = {os.path.basename(path) for path in image['Content'].values()}
+        names = set(image['Content'])
+        documents = []
+        for source_path, new_path, file_hash in imported:
+            if file_hash in section_hashes:
+                continue
+            section_hashes.add(file_hash)
+            name = _uniqueName(os.path.basename(source_path).rsplit('.', 1)[0], names)
+            names.add(name)
+            documents.append((name, new_path))
+        if documents:
+            self.sidebar_model.insertDocuments(section_row, documents)
+            self._commitSection(section_row)
+            self._retainDocuments([_added for _, _added in documents])
+    def _finishImport(self, section_path, imported):
+        _finishImport(self.importer, self.object_store, self.progress, imported)
+        self.importer = None
+        self._addDocuments(section_path, imported)
+
+    def createSection(self):
+        image = self._newSectionImage()
+        self.sidebar_store.addSection(image)
+        self.setExpanded(self.sidebar_model.insertSection(image), True)
+    def createDocument(self, section_path):
+        recent_path = QFileDialog.getOpenFileName(parent=self, caption='Select PDF File',
+            dir=QStandardPaths.writableLocation(QStandardPaths.StandardLocation.DownloadLocation),
+            filter='PDF (*.pdf)')[0]
+        if recent_path:
+            new_path, file_hash = self.object_store.importDocument(recent_path)
+            self._addDocuments(section_path, [(recent_path, new_path, file_hash)])
+    def importFolder(self, section_path):
+        if self.importer is None:
+            self.importer = _startImport(self, self.object_store, self.progress, partial(self._finishImport, section_path))
+    def setActiveDocument(self, path):
+        # only the painted rows read the flag again
+        self.sidebar_model.active_path = path
+        self.viewport().update()
+        self.changeActiveDocument.emit(path)
+class _SidebarModel(QStandardItemModel):
+    # sections are top-level items holding their documents, the tree is laid out without calling back into python
+    PATH_ROLE = Qt.ItemDataRole.UserRole
+    sectionRenamed = Signal(int)
+    documentRenamed = Signal(int, str, str)
+    def __init__(self, images):
+        super().__init__()
+        self.images = images
+        self.active_path = None
+        for image in images:
+            self.appendRow(_SidebarModel._sectionItem(image))
+
+    @staticmethod
+    def _item(text, path):
+        item = QStandardItem(text)
+        item.setData(path, _SidebarModel.PATH_ROLE)
+        return item
+    @staticmethod
+    def _sectionItem(image):
+        section_item = _SidebarModel._item(image['Label'], image['Path'])
+        section_item.appendRows([_SidebarModel._item(name, path) for name, path in image['Content'].items()])
+        return section_item
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        # only edits from the view come through here, renames are mirrored into the sidebar images
+        if role != Qt.ItemDataRole.EditRole or not value or not index.isValid():
+            return False
+        if not index.parent().isValid():
+            self.images[index.row()]['Label'] = value
+            super().setData(index, value, role)
+            self.sectionRenamed.emit(index.row())
+            return True
+        section_row, name = index.parent().row(), index.data()
+        image = self.images[section_row]
+        if value in image['Content']:
+            return value == name
+        image['Content'] = {(value if _name == name else _name): path for _name, path in image['Content'].items()}
+        super().setData(index, value, role)
+        self.documentRenamed.emit(section_row, name, value)
+        return True
+
+    def sectionRow(self, section_path):
+        for section_row, image in enumerate(self.images):
+            if image['Path'] == section_path:
+                return section_row
+        return None
+    def insertSection(self, image):
+        self.images.append(image)
+        self.appendRow(_SidebarModel._sectionItem(image))
+        return self.index(len(self.images) - 1, 0)
+    def removeSection(self, section_row):
+        self.removeRow(section_row)
+        return self.images.pop(section_row)
+    def insertDocuments(self, section_row, documents):
+        self.images[section_row]['Content'].update(documents)
+        self.item(section_row).appendRows([_SidebarModel._item(name, path) for name, path in documents])
+    def removeDocument(self, section_row, doc_row):
+        name = self.item(section_row).child(doc_row).text()
+        self.item(section_row).removeRow(doc_row)
+        return self.images[section_row]['Content'].pop(name)
+class _SidebarDelegate(QStyledItemDelegate):
+    ROW_HEIGHT = 45
+    SPACING = 5
+    FONT_SIZE = {True: 15, False: 12}
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # loaded once for every row instead of once per button
+        self.submenu_icon = QIcon('./GUI/icons/Submenu.png')
+        self.expand_icons = {True: QIcon('./GUI/icons/Expand_active.png'), False: QIcon('./GUI/icons/Expand_inactive.png')}
+
+    @staticmethod
+    def rowRect(rect, is_section):
+        return rect.adjusted(5, 0, -5, -_SidebarDelegate.SPACING) if is_section else \
+            rect.adjusted(5, _SidebarDelegate.SPACING // 2, -5, -_SidebarDelegate.SPACING // 2)
+    @staticmethod
+    def submenuRect(rect, is_section):
+        row_rect = _SidebarDelegate.rowRect(rect, is_section)
+        size = row_rect.height() - (5 if is_section else row_rect.height() // 2)
+        return QRect(row_rect.right() - size - 5, row_rect.center().y() - size // 2, size, size)
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), _SidebarDelegate.ROW_HEIGHT)
+    def paint(self, painter, option, index):
+        is_section = not index.parent().isValid()
+        hovered = bool(option.state & (QStyle.StateFlag.State_MouseOver | QStyle.StateFlag.State_HasFocus))
+        row_rect = _SidebarDelegate.rowRect(option.rect, is_section)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        if is_section:
+            painter.setBrush(QColor(40, 40, 40))
+            painter.drawRoundedRect(row_rect, 5, 5)
+            expanded = bool(option.state & QStyle.StateFlag.State_Open)
+            self.expand_icons[expanded].paint(painter, QRect(row_rect.left(), row_rect.top() + 5, 30, 30))
+        else:
+            if index.data(_SidebarModel.PATH_ROLE) == index.model().active_path:
+                painter.setBrush(QColor(142, 92, 161, 255))
+            else:
+                painter.setBrush(QColor(142, 92, 161, 178) if hovered else QColor(200, 150, 206, 178))
+            painter.drawRoundedRect(row_rect, 7, 7)
+        if is_section or hovered:
+            self.submenu_icon.paint(painter, _SidebarDelegate.submenuRect(option.rect, is_section))
+
+        font = QFont('Dylan')
+        font.setPixelSize(_SidebarDelegate.FONT_SIZE[is_section])
+        painter.setFont(font)
+        painter.setPen(QColor(240, 240, 240) if is_section else QColor(0, 0, 0))
+        painter.drawText(row_rect, Qt.AlignmentFlag.AlignCenter, index.data())
+        painter.restore()
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(_SidebarDelegate.rowRect(option.rect, not index.parent().isValid()))
+
+class DocumentImporter(QThread):
+    # hashes and copies a batch of documents into the object store, the result is handed over once at the end
+    progressChanged = Signal(int, int)
+    importFinished = Signal(list)
+    def __init__(self, source_paths, object_store, workers=None):
+        super().__init__()
+        self.source_paths = source_paths
+        self.object_store = object_store
+        self.workers = workers or max(1, min((os.cpu_count() or 2) * 2, 8))
+        self.cancelled = threading.Event()
+
+    def run(self):
+        # hashing and file copies release the GIL, threads keep the disk busy without process start-up
+        # documents copied before a cancel are still handed over rather than left unreferenced in the store
+        imported = []
+        if self.source_paths:
+            with ThreadPool(min(self.workers, len(self.source_paths))) as pool:
+                for done, result in enumerate(pool.imap_unordered(self._import, self.source_paths), 1):
+                    if result:
+                        imported.append(result)
+                    self.progressChanged.emit(done, len(self.source_paths))
+        self.importFinished.emit(sorted(imported))
+
+    def _import(self, source_path):
+        if self.cancelled.is_set():
+            return None
+        try:
+            new_path, doc_hash = importDocument(source_path, self.object_store.objects_path, self.object_store.objectPath)
+        except OSError:
+            return None
+        return source_path, new_path, doc_hash
+    def cancel(self):
+        self.cancelled.set()
+class SearchIndexer(QThread):
+    # owns the writing side of the index, text is extracted by a pool of worker processes
+    indexChanged = Signal()
+    def __init__(self, index_path, workers=None):
+        super().__init__()
+        self.index_path = index_path
+        self.workers = workers or max(1, min((os.cpu_count() or 2) - 1, 8))
+        self.tasks = queue.Queue()
+        self.running = True
+
+    def run(self):
+        search_index = SearchIndex(self.index_path)
+        pool = None
+        while self.running:
+            tasks = [self.tasks.get()]
+            while not self.tasks.empty():
+                tasks.append(self.tasks.get_nowait())
+            added = []
+            for task in tasks:
+                match task:
+                    case ('sync', paths):
+                        indexed = search_index.paths()
+                        for path in indexed - set(paths):
+                            search_index.removeDocument(path)
+                        added += [path for path in paths if path not in indexed]
+                    case ('add', path):
+                        added.append(path)
+                    case ('remove', path):
+                        search_index.removeDocument(path)
+                        added = [_path for _path in added if _path != path]
+
+            # copies of indexed content only need their path recorded
+            extracted = []
+            for path in added:
+                if os.path.exists(path) and search_index.isIndexed(doc_hash := contentHash(path)):
+                    search_index.addDocument(path, doc_hash, [])
+                elif os.path.exists(path):
+                    extracted.append(path)
+            if extracted and self.running:
+                # created once with every worker, the first batch may be a single document and the pool is kept until stop
+                pool = pool or multiprocessing.Pool(self.workers)
+                for path, doc_hash, page_texts in pool.imap_unordered(extractText, extracted):
+                    if not self.running:
+                        break
+                    if doc_hash:
+                        search_index.addDocument(path, doc_hash, page_texts)
+                    self.indexChanged.emit()
+            self.indexChanged.emit()
+        if pool:
+            pool.terminate()
+        search_index.close()
+
+    def sync(self, paths):
+        self.tasks.put(('sync', list(paths)))
+    def add(self, path):
+        self.tasks.put(('add', path))
+    def remove(self, path):
+        self.tasks.put(('remove', path))
+    def stop(self):
+        self.running = False
+        self.tasks.put(None)
+        self.wait()
+class SearchPanel(QWidget):
+    pageRequested = Signal(str, int)
+    resultsToggled = Signal(bool)
+    QUERY_DELAY = 150
+    def __init__(self, index_path, document_name, width=None):
+        super().__init__()
+        self.search_index = SearchIndex(index_path)
+        self.document_name = document_name
+        self.fixed_width = width
+
+        self.query_timer = QTimer()
+        self.query_timer.setSingleShot(True)
+        self.query_timer.setInterval(SearchPanel.QUERY_DELAY)
+        self.query_timer.timeout.connect(self._query)
+
+        self._setup()
+        self._adjustLayout()
+        self.setStyleSheet("""
+            QLineEdit {
+                background-color: rgb(40, 40, 40);
+                border: 1px solid rgba(255, 255, 255, 0.1);
+                border-radius: 5px;
+                padding: 5px;
+                font-family: 'Dylan';
+                font-size: 12px;
+                color: rgb(240, 240, 240);
+            }
+            QListWidget {
+                background-color: rgb(30, 30, 30);
+                border: none;
+                font-family: 'Dylan';
+                font-size: 12px;
+                color: rgb(240, 240, 240);
+            }
+            QListWidget::item {
+                padding: 5px;
+                border-radius: 5px;
+            }
+            QListWidget::item:hover {
+                background-color: rgba(142, 92, 161, 0.7);
+            }
+        """)
+    def _setup(self):
+        self.setLayout(QVBoxLayout())
+        if self.fixed_width:
+            self.setFixedWidth(self.fixed_width)
+
+        self.search_field = QLineEdit()
+        self.search_field.setPlaceholderText('Search protocols')
+        self.results = QListWidget()
+        self.results.setWordWrap(True)
+        self.results.hide()
+        self.layout().addWidget(self.search_field)
+        self.layout().addWidget(self.results)
+
+        self.search_field.textChanged.connect(self.query_timer.start)
+        self.results.itemClicked.connect(self._pushHit)
+    def _adjustLayout(self):
+        self.layout().setContentsMargins(2, 2, 2, 2)
+        self.layout().setSpacing(2)
+    def _query(self):
+        query = self.search_field.text()
+        self.results.clear()
+        for path, page_num, snippet in self.search_index.query(query):
+            hit = QListWidgetItem(f'{self.document_name(path)}, p. {page_num + 1}\n{snippet}')
+            hit.setData(Qt.ItemDataRole.UserRole, (path, page_num))
+            self.results.addItem(hit)
+        if self.results.isHidden() == bool(query.strip()):
+            self.results.setVisible(bool(query.strip()))
+            self.resultsToggled.emit(bool(query.strip()))
+    def _pushHit(self, hit):
+        self.pageRequested.emit(*hit.data(Qt.ItemDataRole.UserRole))
+
+    def refresh(self):
+        if self.search_field.text().strip():
+            self.query_timer.start()
+class OutlinePanel(QTreeWidget):
+    pageRequested = Signal(int)
+    def __init__(self, width=None):
+        super().__init__()
+        self.entries = []
+        self.entry_children = defaultdict(list)
+
+        if width:
+            self.setFixedWidth(width)
+        self.setColumnCount(2)
+        self.setHeaderHidden(True)
+        self.header().setStretchLastSection(False)
+        self.header().setSectionResizeMode(0, self.header().ResizeMode.Stretch)
+        self.header().setSectionResizeMode(1, self.header().ResizeMode.ResizeToContents)
+        self.itemExpanded.connect(self._expand)
+        self.itemClicked.connect(self._pushEntry)
+        self.setStyleSheet("""
+            QTreeWidget {
+                background-color: rgb(30, 30, 30);
+                border: none;
+                font-family: 'Dylan';
+                font-size: 12px;
+                color: rgb(240, 240, 240);
+            }
+            QTreeWidget::item:hover {
+                background-color: rgba(142, 92, 161, 0.7);
+            }
+        """)
+    def _populate(self, parent_item, parent_index):
+        for index in self.entry_children[parent_index]:
+            level, title, page_num = self.entries[index]
+            entry = QTreeWidgetItem(parent_item, [title, str(page_num + 1)])
+            entry.setData(0, Qt.ItemDataRole.UserRole, index)
+            if self.entry_children[index]:
+                entry.setChildIndicatorPolicy(QTreeWidgetItem.ChildIndicatorPolicy.ShowIndicator)
+    def _expand(self, entry):
+        # nested levels are only built once their parent is opened
+        if not entry.childCount():
+            self._populate(entry, entry.data(0, Qt.ItemDataRole.UserRole))
+    def _pushEntry(self, entry):
+        self.pageRequested.emit(self.entries[entry.data(0, Qt.ItemDataRole.UserRole)][2])
+
+    def setOutline(self, entries):
+        # entries are flat (level, title, page_num) rows in reading order, -1 is the root
+        self.clear()
+        self.entries = entries
+        self.entry_children = defaultdict(list)
+        parents = []
+        for index, (level, title, page_num) in enumerate(entries):
+            while parents and entries[parents[-1]][0] >= level:
+                parents.pop()
+            self.entry_children[parents[-1] if parents else -1].append(index)
+            parents.append(index)
+        self._populate(self.invisibleRootItem(), -1)
+class ThumbnailStrip(QListView):
+    pageRequested = Signal(int)
+    THUMBNAIL_SIZE = QSize(150, 212)
+    def __init__(self, render_cache, width=None):
+        super().__init__()
+        self.thumbnail_model = _ThumbnailModel(render_cache, ThumbnailStrip.THUMBNAIL_SIZE)
+        self.setModel(self.thumbnail_model)
+
+        if width:
+            self.setFixedWidth(width)
+        # uniform items let the view lay out thousands of rows without asking the model for each one
+        self.setUniformItemSizes(True)
+        self.setIconSize(ThumbnailStrip.THUMBNAIL_SIZE)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.clicked.connect(lambda index: self.pageRequested.emit(index.row()))
+        self.setStyleSheet("""
+            QListView {
+                background-color: rgb(30, 30, 30);
+                border: none;
+                font-family: 'Dylan';
+                font-size: 11px;
+                color: rgb(200, 200, 200);
+            }
+            QListView::item:hover {
+                background-color: rgba(142, 92, 161, 0.7);
+            }
+        """)
+
+    def setDocument(self, doc_hash, page_count):
+        self.thumbnail_model.setDocument(doc_hash, page_count)
+        self.scrollToTop()
+    def updateChunk(self, doc_hash, chunk):
+        self.thumbnail_model.updateChunk(doc_hash, chunk)
+class _ThumbnailModel(QAbstractListModel):
+    # thumbnails are decoded from the disk cache only when the view asks for a visible row
+    DECODED_LIMIT = 256
+    def __init__(self, render_cache, thumbnail_size):
+        super().__init__()
+        self.render_cache = render_cache
+        self.doc_hash = None
+        self.page_count = 0
+        self.thumbnails = OrderedDict()
+        self.placeholder = QPixmap(thumbnail_size)
+        self.placeholder.fill(QColor(45, 45, 45))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.page_count
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole:
+            return str(index.row() + 1)
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self._thumbnail(index.row())
+        return None
+    def _thumbnail(self, page_num):
+        if page_num in self.thumbnails:
+            self.thumbnails.move_to_end(page_num)
+            return self.thumbnails[page_num]
+        if not (image_bytes := self.render_cache.readThumbnail(self.doc_hash, page_num)):
+            return self.placeholder
+        self.thumbnails[page_num] = QPixmap.fromImage(QImage.fromData(image_bytes))
+        if len(self.thumbnails) > _ThumbnailModel.DECODED_LIMIT:
+            self.thumbnails.popitem(last=False)
+        return self.thumbnails[page_num]
+
+    def setDocument(self, doc_hash, page_count):
+        self.beginResetModel()
+        self.doc_hash = doc_hash
+        self.page_count = page_count
+        self.thumbnails.clear()
+        self.endResetModel()
+    def updateChunk(self, doc_hash, chunk):
+        if doc_hash != self.doc_hash:
+            return
+        first_page = chunk * RenderCache.THUMBNAIL_CHUNK
+        last_page = min(first_page + RenderCache.THUMBNAIL_CHUNK, self.page_count) - 1
+        if first_page <= last_page:
+            self.dataChanged.emit(self.index(first_page), self.index(last_page), [Qt.ItemDataRole.DecorationRole])
 class PdfView(QGraphicsView):
-    def __init__(self, qsignal):
+    outlineChanged = Signal(list)
+    documentLaidOut = Signal(str, int)
+    thumbnailsReady = Signal(str, int)
+    PAGE_SPACING = 5
+    PAGE_WINDOW = 3
+    PIXMAP_LIMIT = 256 * 2 ** 20
+    ZOOM_RANGE = (0.25, 8)
+    SCROLL_INTERVAL = 16
+    FRAME_BUDGET = 0.008
+    PREFETCH_DELAY = 150
+    PREFETCH_PAGES = 2
+    WARM_DOCUMENTS = 3
+    WARM_LIMIT = 128 * 2 ** 20
+    def __init__(self, qsignal, cache_path=None):
         super().__init__()
         self.qsignal = qsignal
         self.qsignal.connect(self._update_scene)
-
-        self.page_width = 595 * 144 / 72
-        self.page_height = 842 * 144 / 72
-
-        self.update_timer = QTimer()
-        self.page_producer = _PageProducer()
+        self.render_cache = RenderCache(cache_path) if cache_path else None
+        self.doc_hash = None
+        self.page_geometry = None
+        self.doc_meta = {}
+        self.first_page = 0
+
+        self.page_window = PdfView.PAGE_WINDOW
+        self.pixmap_limit = PdfView.PIXMAP_LIMIT
+        self.zoom = 1
+
+        # every page has a cheap placeholder, only pages around the viewport hold a pixmap
+        self.placeholders = []
+        self.page_pixmaps = OrderedDict()
+        self.page_tiles = OrderedDict()
+        self.pixmap_memory = 0
+        # recently viewed documents keep their scene, pixmaps and scroll position, least recently viewed first
+        self.warm_documents = OrderedDict()
+        self.pages_shown = 0
+        self.cache_hits, self.cache_misses = 0, 0
+        self.overlay = None
+
+        # scrolling is coalesced to one viewport update per frame
+        self.scroll_timer = QTimer()
+        self.scroll_timer.setSingleShot(True)
+        self.scroll_timer.setInterval(PdfView.SCROLL_INTERVAL)
+        self.scroll_timer.timeout.connect(self._update_viewport)
+        # a document is only prepared once the pointer or the focus rests on it, a sweep across the sidebar is free
+        self.prefetch_path = None
+        self.prefetch_timer = QTimer()
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(PdfView.PREFETCH_DELAY)
+        self.prefetch_timer.timeout.connect(self._prefetch)
+        self.page_producer = _PageProducer(render_cache=self.render_cache)
+        self.page_producer.start()
+        self.page_notifier = _PageNotifier(self.page_producer.viewer_conn)
+        self.page_notifier.pagesReady.connect(self._load_pages)
+        self.page_notifier.start()
+        QApplication.instance().aboutToQuit.connect(self.shutdown)
 
         self.page_scene = QGraphicsScene()
         self.setScene(self.page_scene)
 
-        self.verticalScrollBar().sliderReleased.connect(self._scrolled)
+        self.verticalScrollBar().valueChanged.connect(self._scrolled)
+        self.horizontalScrollBar().valueChanged.connect(self._scrolled)
+        self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
+        self.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
 
         self.setStyleSheet(""" border: none; background-color: rgb(30, 30, 30); """)
-    def _update_scene(self, path_to_pdf: str) -> None:
-        if self.update_timer.isActive():
-            self.update_timer.stop()
-            self.update_timer.timeout.disconnect()
-        if self.page_producer.isAlive():
-            self.page_producer.stop()
-
-        with fitz.open(path_to_pdf) as pdf:
-            page_count = pdf.page_count
-        self.scene().clear()
-        self.scene().setSceneRect(0, 0, self.page_width, self.page_height * page_count)
-        self.verticalScrollBar().setValue(0)
-
-        self.page_producer.refresh()
-        self.update_timer.timeout.connect(self._load_page)
-
-        self.page_producer.start(path_to_pdf)
-        self.update_timer.start(250)
-    def _load_page(self):
-        if self.page_producer.finished.is_set():
-            self.update_timer.stop()
-            self.update_timer.timeout.disconnect()
-        elif self.page_producer.viewer_conn.poll():
-            page_size, page_num = self.page_producer.viewer_conn.recv()
-            page_bytes = self.page_producer.page_buff.buf[0: page_size]
-            self.page_producer.viewer_conn.send(0)
-
-            page_image = QImage.fromData(bytes(page_bytes))
-            page_pixmap = QPixmap.fromImage(page_image).scaled(self.page_width, self.page_height,
-                                                               Qt.AspectRatioMode.KeepAspectRatioByExpanding,
-                                                               Qt.TransformationMode.SmoothTransformation)
-            page_instance = self.scene().addPixmap(page_pixmap)
-
-            height_offset = page_num * (self.page_height + 5)
-            width_offset = -(page_pixmap.width() - self.page_width) / 2
-            page_instance.setPos(width_offset, height_offset)
+    def _update_scene(self, path_to_pdf: str, page_num=None) -> None:
+        # without a page number a recently viewed document resumes where it was left, others start at the top
+        self._stash()
+        self.first_page = page_num or 0
+        self.doc_hash = contentHash(path_to_pdf)
+        self.page_producer.open(path_to_pdf, self.doc_hash)
+        self.outlineChanged.emit([])
+        if self.doc_hash in self.warm_documents:
+            self._restore(page_num)
+            return
+
+        self.page_scene = QGraphicsScene()
+        self.setScene(self.page_scene)
+        self.page_pixmaps = OrderedDict()
+        self.page_tiles = OrderedDict()
+        self.pixmap_memory = 0
+        self.placeholders = []
+        self.page_geometry = None
+
+        # page sizes come from memory, the disk cache or a metadata pass in a worker, never from the GUI thread
+        doc_meta = self.doc_meta.setdefault(self.doc_hash, {})
+        if 'page_sizes' not in doc_meta and self.render_cache:
+            doc_meta.update(self.render_cache.readMeta(self.doc_hash))
+        if 'page_sizes' in doc_meta:
+            self._set_geometry(doc_meta['page_sizes'])
+        else:
+            self.page_producer.requestMeta('page_sizes')
+    def _set_geometry(self, page_sizes):
+        self.page_geometry = _PageGeometry(page_sizes, _PageProducer.RENDER_SCALE, PdfView.PAGE_SPACING)
+        # a newly opened document gives back the ring a larger one needed, a warm switch keeps it
+        self._set_ratio(shrink=True)
+        for page_num in range(self.page_geometry.pageCount()):
+            x_offset, y_offset, width, height = self.page_geometry.pageRect(page_num)
+            placeholder = self.scene().addRect(0, 0, width, height, Qt.PenStyle.NoPen, QColor(45, 45, 45))
+            placeholder.setPos(x_offset, y_offset)
+            self.placeholders.append(placeholder)
+        self.scene().setSceneRect(0, 0, self.page_geometry.width, self.page_geometry.height)
+
+        self.showPage(self.first_page)
+        self._laid_out()
+    def _stash(self):
+        # only the visible pages are kept, enough to resume at once, tiles belong to the current zoom
+        if self.page_geometry is None:
+            return
+        for tile_key in list(self.page_tiles):
+            self._drop_tile(tile_key)
+        visible = self._visible_pages()
+        for page_num in [page_num for page_num in self.page_pixmaps if page_num not in visible]:
+            self._drop_pixmap(page_num)
+        self.warm_documents[self.doc_hash] = (self.page_scene, self.placeholders, self.page_pixmaps, self.pixmap_memory,
+                                              self.page_geometry, self.mapToScene(0, 0))
+        warm_memory = sum(warm_document[3] for warm_document in self.warm_documents.values())
+        while len(self.warm_documents) > PdfView.WARM_DOCUMENTS or warm_memory > PdfView.WARM_LIMIT:
+            page_scene, _, _, pixmap_memory, _, _ = self.warm_documents.popitem(last=False)[1]
+            page_scene.clear()
+            warm_memory -= pixmap_memory
+    def _restore(self, page_num):
+        (self.page_scene, self.placeholders, self.page_pixmaps, self.pixmap_memory,
+         self.page_geometry, scroll_point) = self.warm_documents.pop(self.doc_hash)
+        self.page_tiles = OrderedDict()
+        self.setScene(self.page_scene)
+        self._set_ratio()
+        if page_num is None:
+            scroll_offset = self.mapFromScene(scroll_point)
+            self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() + scroll_offset.x())
+            self.verticalScrollBar().setValue(self.verticalScrollBar().value() + scroll_offset.y())
+            self._update_viewport()
+        else:
+            self.showPage(page_num)
+        self._laid_out()
+    def _laid_out(self):
+        self.documentLaidOut.emit(self.doc_hash, self.page_geometry.pageCount())
+        # outline and thumbnails are only worked on once no page is waiting
+        if 'outline' in self.doc_meta[self.doc_hash]:
+            self.outlineChanged.emit(self.doc_meta[self.doc_hash]['outline'])
+        else:
+            self.page_producer.requestMeta('outline')
+        if self.render_cache:
+            chunks = range(math.ceil(self.page_geometry.pageCount() / RenderCache.THUMBNAIL_CHUNK))
+            self.page_producer.requestThumbnails([chunk for chunk in chunks
+                                                  if not self.render_cache.hasThumbnails(self.doc_hash, chunk)])
+    def _prefetch(self):
+        # page sizes and the first pages of a hovered document, the pages land in the render cache
+        doc_hash = contentHash(self.prefetch_path)
+        if doc_hash == self.doc_hash or doc_hash in self.warm_documents:
+            return
+        doc_meta = self.doc_meta.setdefault(doc_hash, {})
+        if 'page_sizes' not in doc_meta and self.render_cache:
+            doc_meta.update(self.render_cache.readMeta(doc_hash))
+        fields = [] if 'page_sizes' in doc_meta else ['page_sizes']
+        page_count = len(doc_meta['page_sizes']) if 'page_sizes' in doc_meta else PdfView.PREFETCH_PAGES
+        cache_scale = _PageProducer.RENDER_SCALE * self._page_ratio()
+        page_nums = [page_num for page_num in range(min(PdfView.PREFETCH_PAGES, page_count))
+                     if self.render_cache and not self.render_cache.hasPage(doc_hash, page_num, cache_scale)]
+        self.page_producer.prefetch(self.prefetch_path, doc_hash, fields, page_nums, self._page_ratio())
+    def _set_meta(self, doc_hash, field, value):
+        # None when the document could not be read, nothing is laid out or cached for it
+        if value is None:
+            return
+        self.doc_meta.setdefault(doc_hash, {})[field] = value
+        if self.render_cache:
+            self.render_cache.writeMeta(doc_hash, **{field: value})
+        if doc_hash != self.doc_hash:
+            return
+        if field == 'page_sizes' and self.page_geometry is None:
+            self._set_geometry(value)
+        elif field == 'outline':
+            self.outlineChanged.emit(value)
+    def _load_pages(self):
+        # drain everything that is ready, but give the event loop back once the frame budget is spent
+        if not self.page_producer.isAlive():
+            return
+        frame_end = time.perf_counter() + PdfView.FRAME_BUDGET
+        while self.page_producer.viewer_conn.poll():
+            if time.perf_counter() > frame_end:
+                QTimer.singleShot(0, self._load_pages)
+                return
+            self._handle_result(self.page_producer.receive())
+        self.page_notifier.drained.set()
+    def _handle_result(self, result):
+        match result:
+            case ('meta', doc_hash, field, value):
+                self._set_meta(doc_hash, field, value)
+            case ('thumbs', doc_hash, chunk):
+                self.thumbnailsReady.emit(doc_hash, chunk)
+            case ('preview', page_num, preview_pixmap):
+                self._set_preview(page_num, preview_pixmap)
+            case ('page', (page_num, lod, tile_x, tile_y) as tile_key, tile_pixmap):
+                self._set_tile(tile_key, tile_pixmap)
+            case ('page', page_num, page_pixmap):
+                self._set_pixmap(page_num, page_pixmap)
+    def _load_cached(self, page_num):
+        if TRACER.enabled:
+            read_start = time.perf_counter_ns()
+        cache_scale = _PageProducer.RENDER_SCALE * self.page_producer.page_ratio
+        if not (cache_entry := self.render_cache.read(self.doc_hash, page_num, cache_scale)):
+            self.cache_misses += 1
+            return False
+        self.cache_hits += 1
+        cache_map, width, height, stride, alpha = cache_entry
+        page_bytes = memoryview(cache_map)[RenderCache.HEADER.size:]
+        page_pixmap = _PageProducer.bufferToPixmap(page_bytes, width, height, stride, alpha)
+        page_bytes.release()
+        cache_map.close()
+        if TRACER.enabled:
+            TRACER.span('cache_read', read_start, page=page_num)
+
+        self._set_pixmap(page_num, page_pixmap)
+        return True
+    def _load_thumbnail(self, page_num):
+        # a cached thumbnail is a preview that costs no render
+        if not (image_bytes := self.render_cache.readThumbnail(self.doc_hash, page_num)):
+            return False
+        self._set_preview(page_num, QPixmap.fromImage(QImage.fromData(image_bytes)))
+        return True
+    def _set_preview(self, page_num, preview_pixmap):
+        # a preview only fills an empty placeholder and is smoothed while stretched over it
+        if page_num in self.page_pixmaps:
+            return
+        self._place_pixmap(page_num, preview_pixmap)
+        self.page_pixmaps[page_num].setTransformationMode(Qt.TransformationMode.SmoothTransformation)
+    def _set_pixmap(self, page_num, page_pixmap):
+        if TRACER.enabled:
+            add_start = time.perf_counter_ns()
+        target_width = self.page_geometry.pixelSize(page_num, self.page_producer.page_ratio)[0]
+        if page_num in self.page_pixmaps:
+            # a render started before a zoom change may land after the one at the current ratio
+            if page_pixmap.width() != target_width and self._is_sharp(page_num):
+                return
+            self._drop_pixmap(page_num)
+        self._place_pixmap(page_num, page_pixmap)
+        self.pages_shown += 1
+        if page_pixmap.width() != target_width:
+            self._scrolled()
+        if TRACER.enabled:
+            TRACER.span('add', add_start, page=page_num)
+    def _place_pixmap(self, page_num, page_pixmap):
+        # the worker rendered at the target size, the page is only mapped onto its placeholder
+        page_rect = self.placeholders[page_num].rect()
+        page_instance = QGraphicsPixmapItem(page_pixmap, self.placeholders[page_num])
+        page_instance.setTransform(QTransform.fromScale(page_rect.width() / page_pixmap.width(),
+                                                        page_rect.height() / page_pixmap.height()))
+
+        self.page_pixmaps[page_num] = page_instance
+        self.pixmap_memory += PdfView._pixmap_bytes(page_pixmap)
+        self._evict()
+    def _set_tile(self, tile_key, tile_pixmap):
+        page_num, lod, tile_x, tile_y = tile_key
+        if lod != self._tile_lod():
+            return
+        if tile_key in self.page_tiles:
+            self._drop_tile(tile_key)
+        # tiles sit above the stretched page, scaled back from their level of detail
+        tile_instance = QGraphicsPixmapItem(tile_pixmap, self.placeholders[page_num])
+        tile_instance.setScale(1 / lod)
+        tile_instance.setPos(tile_x * _PageProducer.TILE_SIZE / lod, tile_y * _PageProducer.TILE_SIZE / lod)
+        tile_instance.setZValue(1)
+
+        self.page_tiles[tile_key] = tile_instance
+        self.pixmap_memory += PdfView._pixmap_bytes(tile_pixmap)
+        self._evict()
+    def _drop_pixmap(self, page_num):
+        page_instance = self.page_pixmaps.pop(page_num)
+        self.pixmap_memory -= PdfView._pixmap_bytes(page_instance.pixmap())
+        self.scene().removeItem(page_instance)
+    def _drop_tile(self, tile_key):
+        tile_instance = self.page_tiles.pop(tile_key)
+        self.pixmap_memory -= PdfView._pixmap_bytes(tile_instance.pixmap())
+        self.scene().removeItem(tile_instance)
+    def _evict(self):
+        # least recently seen first, visible pages are never dropped
+        visible = self._visible_pages()
+        window = self._window_pages()
+        visible_tiles = set(self._visible_tiles())
+        lod = self._tile_lod()
+        for tile_key in list(self.page_tiles):
+            if tile_key in visible_tiles:
+                continue
+            if tile_key[1] != lod or tile_key[0] not in window or self.pixmap_memory > self.pixmap_limit:
+                self._drop_tile(tile_key)
+        for page_num in list(self.page_pixmaps):
+            if page_num in visible:
+                continue
+            if page_num not in window or self.pixmap_memory > self.pixmap_limit:
+                self._drop_pixmap(page_num)
+    def _is_sharp(self, page_num):
+        return (page_num in self.page_pixmaps and self.page_pixmaps[page_num].pixmap().width() ==
+                self.page_geometry.pixelSize(page_num, self.page_producer.page_ratio)[0])
+    def _page_ratio(self):
+        # device pixels per scene unit for whole pages, zooming in past 1x is left to the tiles
+        return min(self.zoom, 1) * self.devicePixelRatioF()
+    def _set_ratio(self, shrink=False):
+        page_ratio = self._page_ratio()
+        # whatever arrived while the ring was drained for a new slot size is used, not rendered again
+        for result in self.page_producer.reserve(_PageProducer.slotSize(self.page_geometry.page_sizes,
+                                                                        self.page_producer.transport,
+                                                                        _PageProducer.RENDER_SCALE * page_ratio), shrink):
+            self._handle_result(result)
+        self.page_producer.setPageRatio(page_ratio)
+    def _tile_lod(self):
+        # past 1x the page gets stretched, sharp tiles come in power-of-two levels of device pixels per scene unit
+        return 2 ** math.ceil(math.log2(self.zoom * self.devicePixelRatioF())) if self.zoom > 1 else 0
+    def _visible_tiles(self):
+        if not (lod := self._tile_lod()):
+            return []
+        visible_rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        tile_span = _PageProducer.TILE_SIZE / lod
+        tiles = []
+        for page_num in self._visible_pages():
+            placeholder = self.placeholders[page_num]
+            page_rect = visible_rect.translated(-placeholder.pos()).intersected(placeholder.rect())
+            if page_rect.isEmpty():
+                continue
+            last_x = math.ceil(placeholder.rect().width() / tile_span) - 1
+            last_y = math.ceil(placeholder.rect().height() / tile_span) - 1
+            for tile_y in range(int(page_rect.top() // tile_span), min(int(page_rect.bottom() // tile_span), last_y) + 1):
+                for tile_x in range(int(page_rect.left() // tile_span), min(int(page_rect.right() // tile_span), last_x) + 1):
+                    tiles.append((page_num, lod, tile_x, tile_y))
+        return tiles
+    def _visible_pages(self):
+        if not self.placeholders:
+            return range(0)
+        visible_rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        return range(self.page_geometry.pageAt(visible_rect.top()), self.page_geometry.pageAt(visible_rect.bottom()) + 1)
+    def _window_pages(self):
+        visible = self._visible_pages()
+        if not visible:
+            return visible
+        return range(max(0, visible.start - self.page_window), min(len(self.placeholders), visible.stop + self.page_window))
     def _scrolled(self):
-        # сначала проверить отрендерена страница или нет, после обрабатывать таймер -> убрать проверку в pages в worker'е
-        self.update_timer.stop()
-        with self.page_producer.page_num.get_lock():
-            y_offset = self.verticalScrollBar().value()
-            page_num = int(y_offset / (self.page_height + 5))
-            self.page_producer.page_num.value = page_num
-        self.page_producer.page_scrolled.set()
-        self.update_timer.start()
+        if not self.scroll_timer.isActive():
+            self.scroll_timer.start()
+    def _update_viewport(self):
+        visible = self._visible_pages()
+        if not visible:
+            return
+        for page_num in visible:
+            if page_num in self.page_pixmaps:
+                self.page_pixmaps.move_to_end(page_num)
+        visible_tiles = self._visible_tiles()
+        for tile_key in visible_tiles:
+            if tile_key in self.page_tiles:
+                self.page_tiles.move_to_end(tile_key)
+        self._evict()
+        if self._page_ratio() != self.page_producer.page_ratio:
+            self._set_ratio()
+
+        # request no more of the window than the memory cap can hold, nearest pages first
+        page_bytes = self.page_geometry.maxPageBytes(self.page_producer.page_ratio)
+        page_budget = max(len(visible), self.pixmap_limit // page_bytes)
+        window = sorted(self._window_pages(), key=lambda page_num: abs(page_num - visible.start))[:page_budget]
+
+        missing = [page_num for page_num in window if not self._is_sharp(page_num)]
+        if self.render_cache:
+            missing = [page_num for page_num in missing if not self._load_cached(page_num)]
+
+        # visible pages with nothing to show get a low resolution pass, sent ahead of the full pages
+        previews = [page_num for page_num in visible if page_num in missing and page_num not in self.page_pixmaps]
+        if self.render_cache:
+            previews = [page_num for page_num in previews if not self._load_thumbnail(page_num)]
+        self.page_producer.requestPreviews(previews)
+
+        missing += [tile_key for tile_key in visible_tiles if tile_key not in self.page_tiles]
+
+        self.page_producer.prioritise(visible.start, visible.stop - 1)
+        self.page_producer.request(missing)
+
+    def shutdown(self):
+        # scroll bars still report while the view is torn down, after the timer they would restart is gone
+        self.verticalScrollBar().blockSignals(True)
+        self.horizontalScrollBar().blockSignals(True)
+        self.prefetch_timer.stop()
+        self.page_notifier.stop()
+        self.page_producer.shutdown()
+    def prefetchDocument(self, path_to_pdf):
+        # restarted by every hover, only the document the pointer stays on is prepared
+        self.prefetch_path = path_to_pdf
+        self.prefetch_timer.start()
+    def showPage(self, page_num):
+        # the target is scrolled to and requested before anything else, a pending layout takes it as its start page
+        if self.page_geometry is None:
+            self.first_page = page_num
+            return
+        page_num = max(min(page_num, self.page_geometry.pageCount() - 1), 0)
+        page_top = self.mapFromScene(0, self.page_geometry.offsets[page_num]).y()
+        self.verticalScrollBar().setValue(self.verticalScrollBar().value() + page_top)
+        self._update_viewport()
+    def showDocument(self, path_to_pdf, page_num=0):
+        if self.page_geometry is not None and contentHash(path_to_pdf) == self.doc_hash:
+            self.showPage(page_num)
+        else:
+            self._update_scene(path_to_pdf, page_num)
+
+    def setZoom(self, zoom):
+        self.zoom = min(max(zoom, PdfView.ZOOM_RANGE[0]), PdfView.ZOOM_RANGE[1])
+        self.setTransform(QTransform.fromScale(self.zoom, self.zoom))
+        self._scrolled()
+    def zoomIn(self):
+        self.setZoom(self.zoom * 1.25)
+    def zoomOut(self):
+        self.setZoom(self.zoom / 1.25)
+    def setPageWindow(self, page_window):
+        self.page_window = page_window
+        self._scrolled()
+    def setPixmapLimit(self, pixmap_limit):
+        self.pixmap_limit = pixmap_limit
+        self._evict()
+    def pixmapMemory(self):
+        return self.pixmap_memory
+    def setTracing(self, tracing):
+        self.page_producer.setTracing(tracing)
+    def exportTrace(self, trace_path):
+        TRACER.export(trace_path)
+    def setOverlay(self, overlay):
+        if overlay and self.overlay is None:
+            self.overlay = _PerformanceOverlay(self)
+            self.overlay.show()
+        elif not overlay and self.overlay is not None:
+            self.overlay.deleteLater()
+            self.overlay = None
+    def toggleOverlay(self):
+        self.setOverlay(self.overlay is None)
 
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._scrolled()
     def wheelEvent(self, event):
-        super().wheelEvent(event)
-        if self.page_producer.isAlive() and event.isEndEvent():
-            self._scrolled()
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            if event.angleDelta().y() > 0:
+                self.zoomIn()
+            else:
+                self.zoomOut()
+            event.accept()
+        else:
+            super().wheelEvent(event)
+
+    @staticmethod
+    def _pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+class _PerformanceOverlay(QLabel):
+    # pages/sec, queue depth, cache hit rate and pixmap memory in a corner of the viewer, sampled twice a second
+    UPDATE_INTERVAL = 500
+    def __init__(self, view: PdfView):
+        super().__init__(view.viewport())
+        self.view = view
+        self.last_pages, self.last_time = view.pages_shown, time.perf_counter()
+        self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.setStyleSheet("""
+            QLabel {
+                background-color: rgba(0, 0, 0, 0.6);
+                color: rgb(240, 240, 240);
+                font-family: monospace;
+                font-size: 11px;
+                padding: 4px;
+                border-radius: 4px;
+            }
+        """)
+
+        self.update_timer = QTimer(self)
+        self.update_timer.setInterval(_PerformanceOverlay.UPDATE_INTERVAL)
+        self.update_timer.timeout.connect(self._sample)
+        self.update_timer.start()
+        self._sample()
+
+    def _sample(self):
+        view, now = self.view, time.perf_counter()
+        pages_per_sec = (view.pages_shown - self.last_pages) / (now - self.last_time)
+        self.last_pages, self.last_time = view.pages_shown, now
+        cache_reads = view.cache_hits + view.cache_misses
+        queue_depth = view.page_producer.queueDepth()
+        self.setText(f'{pages_per_sec:5.1f} pages/sec\n'
+                     f'{queue_depth:5d} queued\n'
+                     f"{f'{view.cache_hits / cache_reads:5.0%}' if cache_reads else '    -'} cache hits\n"
+                     f'{view.pixmapMemory() / 2 ** 20:5.0f} MB pixmaps')
+        self.adjustSize()
+        self.move(view.viewport().width() - self.width() - 5, 5)
+        if TRACER.enabled:
+            TRACER.counter('viewer', pages_per_sec=pages_per_sec, queue_depth=queue_depth,
+                           pixmap_mb=view.pixmapMemory() / 2 ** 20)
+class _PageGeometry:
+    # page sizes in points, laid out top to bottom in scene units and centred horizontally
+    def __init__(self, page_sizes, scale, spacing):
+        self.page_sizes = [tuple(page_size) for page_size in page_sizes]
+        self.scale = scale
+        self.width = max((width for width, _ in page_sizes), default=0) * scale
+        self.offsets = [0]
+        for _, height in page_sizes:
+            self.offsets.append(self.offsets[-1] + height * scale + spacing)
+        self.height = self.offsets[-1]
+
+    def pageCount(self):
+        return len(self.page_sizes)
+    def pageRect(self, page_num):
+        width, height = self.page_sizes[page_num]
+        return (self.width - width * self.scale) / 2, self.offsets[page_num], width * self.scale, height * self.scale
+    def pageAt(self, y_offset):
+        return min(max(bisect_right(self.offsets, y_offset) - 1, 0), max(self.pageCount() - 1, 0))
+    def pixelSize(self, page_num, ratio=1):
+        # the pixmap size a page is rendered at, the workers round the same way
+        width, height = self.page_sizes[page_num]
+        return max(1, round(width * self.scale * ratio)), max(1, round(height * self.scale * ratio))
+    def maxPageBytes(self, ratio=1):
+        return max((math.ceil(width * self.scale * ratio) * math.ceil(height * self.scale * ratio) * 4
+                    for width, height in self.page_sizes), default=1)
+class _PageNotifier(QThread):
+    # waits on the result pipe off the GUI thread, reading stays with the viewer
+    pagesReady = Signal()
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+        self.drained = threading.Event()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            if wait([self.connection], timeout=0.5):
+                self.drained.clear()
+                # stop() may have set drained just before the clear, running is already False by then
+                if not self.running:
+                    break
+                self.pagesReady.emit()
+                self.drained.wait()
+    def stop(self):
+        self.running = False
+        self.drained.set()
+        self.wait()
 class _PageProducer:
-    def __init__(self):
-        self.process = None
+    TRANSPORTS = ('raw', 'png')
+    RENDER_SCALE = 2
+    THUMBNAIL_SCALE = 0.25
+    PREVIEW_SCALE = 0.5
+    PREVIEW_BUDGET = 0.03
+    TILE_SIZE = 512
+    OPEN_DOCUMENTS = 4
+    HEADING_RATIO = 1.2
+    HEADING_LENGTH = 80
+    HEADING_LEVELS = 3
+    HEADING_CHUNK = 16
+    STOP = -1
+    STOP_TIMEOUT = 5
+    def __init__(self, transport='raw', workers=None, depth=None, render_cache=None):
+        if transport not in _PageProducer.TRANSPORTS:
+            raise ValueError(f'Unknown page transport: {transport}')
+        self.transport = transport
+        self.workers = workers or max(1, min((os.cpu_count() or 2) - 1, 8))
+        # one slot a worker renders into and two waiting to be decoded, the ring is sized per document
+        self.depth = depth or self.workers + 2
+        self.render_cache = render_cache
+        self.slot_size = 0
+        self.processes = []
+        self.task_conns = []
         self.page_buff = None
         self.viewer_conn, self.worker_conn = None, None
+        self.result_lock = None
         self.path_to_pdf = None
-        self.page_num = multiprocessing.Value(ctypes.c_int)
-        self.page_scrolled = Event()
-        self.finished = Event()
-
-    def start(self, path_to_df):
-        self.path_to_pdf = path_to_df
-        self.process.start()
-    def stop(self):
-        self._interruption()
-    def refresh(self):
-        self.process = multiprocessing.Process(target=self._page_conveyor)
-        self.page_buff = shared_memory.SharedMemory(create=True, size=int(10e7))
-        self.viewer_conn, self.worker_conn = Pipe()
-        self.finished.clear()
+        self.doc_hash = None
+
+        # dispatcher state, lives in the viewer process only
+        self.generation = 0
+        self.pending = []
+        self.meta_tasks = deque()
+        self.prefetch_tasks = deque()
+        self.preview_pages = set()
+        self.viewport = (0, 0)
+        self.free_slots = deque()
+        self.in_flight = []
+        self.in_flight_pages = {}
+        self.slot_workers = {}
+        self.failed_pages = set()
+        self.draining = False
+        self.cancelled = multiprocessing.Array(ctypes.c_bool, self.depth, lock=False)
+        # long background tasks look at it between steps and give up once their document is left
+        self.current_generation = multiprocessing.Value(ctypes.c_int, 0, lock=False)
+        self.background_workers = set()
+        self.page_ratio = 1
+        self.tracing = False
+
+    @staticmethod
+    def slotSize(page_sizes, transport='raw', scale=RENDER_SCALE):
+        # a slot holds the largest page or a zoomed tile, whichever is bigger
+        page_bytes = 0
+        for width, height in [*page_sizes, (_PageProducer.TILE_SIZE / scale, _PageProducer.TILE_SIZE / scale)]:
+            # +1 covers the outward rounding of the pixmap bounds
+            width = math.ceil(width * scale) + 1
+            height = math.ceil(height * scale) + 1
+            slot_size = width * height * 3
+            if transport == 'png':
+                # png worst case: filter byte per row plus zlib/chunk overhead
+                slot_size += height + 4096
+            page_bytes = max(page_bytes, slot_size)
+        return page_bytes
+
+    def start(self):
+        if self.isAlive():
+            return
+        # the ring exists before the workers fork, so they share the parent's resource tracker
+        # it starts empty and gets its slot size from the first document
+        self._allocate(self.slot_size)
+        self.viewer_conn, self.worker_conn = Pipe(duplex=False)
+        self.result_lock = multiprocessing.Lock()
+        for worker_id in range(self.workers):
+            process, task_writer = self._spawn(worker_id)
+            self.processes.append(process)
+            self.task_conns.append(task_writer)
+        self.in_flight = [0] * self.workers
+    def open(self, path_to_pdf, doc_hash=None):
+        self.start()
+        self.cancel()
+        self.path_to_pdf = path_to_pdf
+        self.doc_hash = doc_hash
+        self.viewport = (0, 0)
+    def reserve(self, slot_size, shrink=False):
+        # the ring grows whenever a page would not fit, it shrinks only on request and when less than half is needed
+        # results received while the old ring drains are returned for the caller to handle
+        if slot_size > self.slot_size or shrink and slot_size < self.slot_size // 2:
+            return self._resize(slot_size)
+        return []
+    def setPageRatio(self, page_ratio):
+        # whole pages are rendered at RENDER_SCALE * page_ratio, pages already sent at another ratio are cancelled
+        if page_ratio == self.page_ratio:
+            return
+        self.page_ratio = page_ratio
+        for page_key in [page_key for page_key in self.in_flight_pages if not isinstance(page_key, tuple)]:
+            self.cancelled[self.in_flight_pages.pop(page_key)] = True
+    def requestMeta(self, field):
+        # page sizes gate the layout and go out at once, other metadata waits until no page is pending
+        task = ('meta', self.generation, self.path_to_pdf, self.doc_hash, field)
+        if field == 'page_sizes':
+            worker_id = self._urgent_worker()
+            self._send(worker_id, task)
+            self.in_flight[worker_id] += 1
+        else:
+            self.meta_tasks.append(task)
+            self._dispatch()
+    def requestPreviews(self, page_nums):
+        # one task for all pages, rendered small and sent through the result pipe so no slot is held
+        # the worker stops once PREVIEW_BUDGET is spent, the full pages queued behind it wait no longer than that
+        if not (page_nums := [page_num for page_num in page_nums if page_num not in self.preview_pages]) or \
+                self.path_to_pdf is None:
+            return
+        self.preview_pages.update(page_nums)
+        worker_id = self._urgent_worker()
+        self._send(worker_id, ('preview', self.generation, self.path_to_pdf, page_nums))
+        self.in_flight[worker_id] += 1
+    def prefetch(self, path_to_pdf, doc_hash, fields, page_nums, page_ratio=1):
+        # speculative work for a document that may be opened next, it replaces any earlier prefetch
+        # and goes to idle workers only after every other task, opening a document drops what is left of it
+        self.prefetch_tasks = deque([('meta', self.generation, path_to_pdf, doc_hash, field) for field in fields] +
+                                    [('prefetch', path_to_pdf, doc_hash, page_num, page_ratio) for page_num in page_nums])
+        self._dispatch()
+    def requestThumbnails(self, chunks):
+        # written to the render cache by the workers, one chunk of pages per task
+        self.meta_tasks.extend(('thumbs', self.generation, self.path_to_pdf, self.doc_hash, chunk) for chunk in chunks)
+        self._dispatch()
+    def request(self, page_keys):
+        # replaces whatever is still pending, a key is a page number or a (page_num, lod, tile_x, tile_y) tile
+        # work already sent for pages no longer wanted is cancelled, wanted pages are not sent twice
+        page_keys = set(page_keys)
+        for page_key in [page_key for page_key in self.in_flight_pages if page_key not in page_keys]:
+            self.cancelled[self.in_flight_pages.pop(page_key)] = True
+        page_keys -= self.failed_pages
+        self.pending = [(self._priority(page_key), page_key) for page_key in page_keys - self.in_flight_pages.keys()]
+        heapq.heapify(self.pending)
+        self._dispatch()
+    def cancel(self):
+        # results already in flight come back tagged with an outdated generation and are dropped
+        self.generation += 1
+        self.current_generation.value = self.generation
+        for slot in self.in_flight_pages.values():
+            self.cancelled[slot] = True
+        self.pending = []
+        self.meta_tasks.clear()
+        self.prefetch_tasks.clear()
+        self.preview_pages.clear()
+        self.failed_pages.clear()
+        self.in_flight_pages = {}
+        self.path_to_pdf = None
+        self.doc_hash = None
+    def prioritise(self, first_page, last_page=None):
+        self.viewport = (first_page, first_page if last_page is None else last_page)
+        self.pending = [(self._priority(page_key), page_key) for _, page_key in self.pending]
+        heapq.heapify(self.pending)
+    def shutdown(self):
+        if not self.processes:
+            return
+        try:
+            self._interruption()
+        finally:
+            self._cleanup()
+    def setTracing(self, tracing):
+        # the workers keep their own tracer and send its events along with their results
+        self.tracing = tracing
+        TRACER.enable(tracing)
+        for worker_id in range(len(self.task_conns)):
+            self._send(worker_id, ('trace', tracing))
+    def queueDepth(self):
+        return len(self.pending) + len(self.meta_tasks) + len(self.prefetch_tasks) + sum(self.in_flight)
     def isAlive(self):
-        if self.process:
-            return self.process.is_alive()
-        return False
-
+        # a worker that dies is replaced, so the producer lives from start until shutdown
+        return bool(self.processes)
+    def isIdle(self):
+        return not self.pending and not any(self.in_flight)
+    def receive(self):
+        # ('page', page_key, pixmap), ('preview', page_num, pixmap), ('meta', doc_hash, field, value),
+        # ('thumbs', doc_hash, chunk) or None for cancelled work and worker trace events
+        if TRACER.enabled:
+            receive_start = time.perf_counter_ns()
+        message = self.viewer_conn.recv()
+        if TRACER.enabled:
+            TRACER.span('receive', receive_start, message=message[0])
+        match message:
+            case ('trace', events):
+                TRACER.extend(events)
+                return None
+            case ('meta', generation, worker_id, doc_hash, field, value):
+                self._done(worker_id)
+                self._dispatch()
+                return 'meta', doc_hash, field, value
+            case ('preview', generation, worker_id, page_num, preview_info, is_last):
+                if is_last:
+                    self._done(worker_id)
+                    self._dispatch()
+                if generation != self.generation:
+                    return None
+                self.preview_pages.discard(page_num)
+                if preview_info is None:
+                    return None
+                return 'preview', page_num, _PageProducer.bufferToPixmap(*preview_info)
+            case ('thumbs', generation, worker_id, doc_hash, chunk):
+                self._done(worker_id)
+                self._dispatch()
+                return 'thumbs', doc_hash, chunk
+            case ('prefetch', worker_id):
+                self._done(worker_id)
+                self._dispatch()
+                return None
+            case ('page', generation, worker_id, slot, page_size, page_key, width, height, stride, alpha):
+                self._done(worker_id)
+                page_pixmap = None
+                if self.in_flight_pages.get(page_key) == slot:
+                    del self.in_flight_pages[page_key]
+                if generation == self.generation and page_size > 0:
+                    page_pixmap = self._to_pixmap(slot, page_size, width, height, stride, alpha)
+                elif generation == self.generation and page_size < 0:
+                    self.failed_pages.add(page_key)
+                if self.slot_workers.pop(slot, None) is not None:
+                    self.free_slots.append(slot)
+                self._dispatch()
+                return ('page', page_key, page_pixmap) if page_pixmap is not None else None
+
+    @staticmethod
+    def bufferToPixmap(page_bytes, width, height, stride, alpha):
+        # wrap the buffer in place, QPixmap.fromImage makes the only copy
+        page_format = QImage.Format.Format_RGBA8888 if alpha else QImage.Format.Format_RGB888
+        page_image = QImage(page_bytes, width, height, stride, page_format)
+        page_pixmap = QPixmap.fromImage(page_image)
+        del page_image
+        return page_pixmap
+
+    def _to_pixmap(self, slot, page_size, width, height, stride, alpha):
+        if TRACER.enabled:
+            decode_start = time.perf_counter_ns()
+        slot_offset = slot * self.slot_size
+        page_bytes = self.page_buff.buf[slot_offset: slot_offset + page_size]
+        if self.transport == 'png':
+            page_pixmap = QPixmap.fromImage(QImage.fromData(bytes(page_bytes)))
+        else:
+            page_pixmap = _PageProducer.bufferToPixmap(page_bytes, width, height, stride, alpha)
+        page_bytes.release()
+        if TRACER.enabled:
+            TRACER.span('decode', decode_start, transport=self.transport)
+        return page_pixmap
+    def _resize(self, slot_size):
+        # the ring is reused between documents until a page does not fit, renders holding a slot are drained first
+        # nothing new is dispatched meanwhile, pending pages go out into the new ring
+        # metadata, thumbnails, previews and prefetches never touch the ring and are not waited for
+        results = []
+        self.draining = True
+        try:
+            while self.slot_workers:
+                if not self.viewer_conn.poll(0.1):
+                    self._reap()
+                elif (result := self.receive()) is not None:
+                    results.append(result)
+        finally:
+            self.draining = False
+        self._allocate(slot_size)
+        for worker_id in range(len(self.task_conns)):
+            self._send(worker_id, ('ring', self.page_buff.name, self.slot_size))
+        self._dispatch()
+        return results
+    def _allocate(self, slot_size):
+        if self.page_buff:
+            self.page_buff.close()
+            self.page_buff.unlink()
+        self.slot_size = slot_size
+        self.page_buff = shared_memory.SharedMemory(create=True, size=max(self.slot_size * self.depth, 1))
+        self.free_slots = deque(range(self.depth))
+        self.slot_workers = {}
+    def _spawn(self, worker_id):
+        task_reader, task_writer = Pipe(duplex=False)
+        process = multiprocessing.Process(target=_PageProducer._page_conveyor, daemon=True,
+                                          args=(self.transport, self.render_cache, worker_id, task_reader,
+                                                self.worker_conn, self.result_lock, self.cancelled,
+                                                self.current_generation))
+        process.start()
+        task_reader.close()
+        task_writer.send(('ring', self.page_buff.name, self.slot_size))
+        if self.tracing:
+            task_writer.send(('trace', True))
+        return process, task_writer
+    def _send(self, worker_id, task):
+        try:
+            self.task_conns[worker_id].send(task)
+        except OSError:
+            # the pipe broke because the worker is gone, it is replaced and gets the task instead
+            self.processes[worker_id].join(1)
+            self._reap()
+            self.task_conns[worker_id].send(task)
+    def _reap(self):
+        # a worker that died never answers: its counts and slots are released and a fresh one takes its place
+        for worker_id, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            process.join()
+            process.close()
+            self.task_conns[worker_id].close()
+            self.in_flight[worker_id] = 0
+            self.background_workers.discard(worker_id)
+            # previews it owed are asked for again by the next viewport update
+            self.preview_pages.clear()
+            for slot in [slot for slot, slot_worker in self.slot_workers.items() if slot_worker == worker_id]:
+                del self.slot_workers[slot]
+                self.free_slots.append(slot)
+                for page_key in [page_key for page_key, page_slot in self.in_flight_pages.items() if page_slot == slot]:
+                    del self.in_flight_pages[page_key]
+            self.processes[worker_id], self.task_conns[worker_id] = self._spawn(worker_id)
+    def _done(self, worker_id):
+        # an answer sent just before its worker died may arrive after the worker was reaped
+        self.in_flight[worker_id] = max(self.in_flight[worker_id] - 1, 0)
+        if not self.in_flight[worker_id]:
+            self.background_workers.discard(worker_id)
+    def _urgent_worker(self):
+        # layout and previews stay clear of a worker that took background work, it may be busy for a while
+        return min(range(self.workers), key=lambda worker_id: (worker_id in self.background_workers,
+                                                               self.in_flight[worker_id]))
+    def _dispatch(self):
+        if self.draining:
+            return
+        self._reap()
+        while self.pending and self.free_slots:
+            worker_id = min(range(self.workers), key=self.in_flight.__getitem__)
+            if self.in_flight[worker_id] >= 2:
+                break
+            _, page_key = heapq.heappop(self.pending)
+            slot = self.free_slots.popleft()
+            self.cancelled[slot] = False
+
+            self._send(worker_id, ('render', self.generation, self.path_to_pdf, self.doc_hash, page_key, slot,
+                                   self.page_ratio))
+            self.in_flight[worker_id] += 1
+            self.in_flight_pages[page_key] = slot
+            self.slot_workers[slot] = worker_id
+        # background work only goes to an idle worker, a page requested later waits for one task at most
+        while (self.meta_tasks or self.prefetch_tasks) and not self.pending:
+            worker_id = min(range(self.workers), key=self.in_flight.__getitem__)
+            if self.in_flight[worker_id]:
+                break
+            self._send(worker_id, (self.meta_tasks or self.prefetch_tasks).popleft())
+            self.in_flight[worker_id] += 1
+            self.background_workers.add(worker_id)
+    def _priority(self, page_key):
+        # distance from the viewport in pages, below goes before above at equal distance
+        # a whole page goes before the tiles drawn over it
+        page_num, is_tile = (page_key[0], True) if isinstance(page_key, tuple) else (page_key, False)
+        first_page, last_page = self.viewport
+        if page_num < first_page:
+            return first_page - page_num, True, is_tile, page_num
+        return max(0, page_num - last_page), False, is_tile, page_num
     def _interruption(self):
-        self.viewer_conn.send(1)
-        self.process.join()
-        self.process.close()
-        self.viewer_conn.close()
+        for task_conn in self.task_conns:
+            try:
+                task_conn.send(_PageProducer.STOP)
+            except OSError:
+                pass
+        # a worker blocked sending a large result only gets to STOP once the pipe is read, what it sends is dropped
+        # one that still has not stopped by the deadline is terminated, so quitting never hangs
+        deadline = time.perf_counter() + _PageProducer.STOP_TIMEOUT
+        while (sentinels := [process.sentinel for process in self.processes if process.is_alive()]) and \
+                time.perf_counter() < deadline:
+            if self.viewer_conn in wait([self.viewer_conn, *sentinels], timeout=deadline - time.perf_counter()):
+                try:
+                    self.viewer_conn.recv()
+                except (EOFError, OSError):
+                    break
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+            process.close()
     def _cleanup(self):
-        self.page_buff.close()
-        self.page_buff.unlink()
+        for task_conn in self.task_conns:
+            task_conn.close()
         self.viewer_conn.close()
         self.worker_conn.close()
-        self.process = None
+        if self.page_buff:
+            self.page_buff.close()
+            self.page_buff.unlink()
+        self.processes, self.task_conns = [], []
         self.page_buff = None
+        self.slot_size = 0
         self.viewer_conn, self.worker_conn = None, None
         self.path_to_pdf = None
-    def _page_conveyor(self):
-        with fitz.open(self.path_to_pdf) as pdf:
-            page_range = set(range(pdf.page_count))
-            page_num = 0
-            while True:
-                if self.page_scrolled.is_set():
-                    self.page_scrolled.clear()
-                    if self.page_num.value in page_range:
-                        page_num = self.page_num.value
-
-                result = self._render(pdf, page_num)  # 0 - Page Loaded, 1 - Process Interrupted
-
-                page_range.discard(page_num)
-                if not page_range or result != 0:
-                    self.finished.set()
-                    self._cleanup()
-                    break
-                else:
-                    page_num += 1
-                    if page_num not in page_range:
-                        page_num = min(page_range)
-    def _render(self, pdf, page_num):
-        pixmap = pdf[page_num].get_pixmap(matrix=fitz.Matrix(2, 2))  # ~ 0.02 sec/page -> 50 pages/sec | limitless stage
-        page_bytes = pixmap.tobytes()  # automatically convert to png
+        self.pending = []
+        self.in_flight_pages = {}
+        self.slot_workers = {}
+
+    @staticmethod
+    def _page_conveyor(transport, render_cache, worker_id, task_conn, result_conn, result_lock, cancelled,
+                       current_generation):
+        # fitz is only ever imported by the workers, the viewer process never pays for it
+        import fitz
+        # a forked worker starts with a copy of the viewer's tracer, tracing is switched on by a task
+        TRACER.enable(False)
+        TRACER.flush()
+        thumbnail_matrix = fitz.Matrix(_PageProducer.THUMBNAIL_SCALE, _PageProducer.THUMBNAIL_SCALE)
+        preview_matrix = fitz.Matrix(_PageProducer.PREVIEW_SCALE, _PageProducer.PREVIEW_SCALE)
+        page_buff, buff_name, slot_size = None, None, 0
+        documents = OrderedDict()
+        # last full page render time per document, previews are skipped where full pages beat the budget anyway
+        render_times = {}
+        # every task is answered, a document that cannot be opened or read gets an empty answer instead of
+        # taking the worker down: encrypted (ValueError), damaged (FileDataError) or gone (FileNotFoundError)
+        while (task := task_conn.recv()) != _PageProducer.STOP:
+            if TRACER.enabled:
+                task_start = time.perf_counter_ns()
+            match task:
+                case ('ring', buff_name, slot_size):
+                    # attached on the next render: a ring replaced before any render may be unlinked already
+                    pass
+                case ('trace', tracing):
+                    TRACER.enable(tracing)
+                    TRACER.flush()
+                case ('meta', generation, path_to_pdf, doc_hash, field):
+                    try:
+                        value = _PageProducer._metadata(_PageProducer._document(documents, path_to_pdf), field,
+                                                        lambda: current_generation.value != generation)
+                    except Exception:
+                        value = None
+                    if TRACER.enabled:
+                        TRACER.span('meta', task_start, field=field)
+                    with result_lock:
+                        result_conn.send(('meta', generation, worker_id, doc_hash, field, value))
+                case ('preview', generation, path_to_pdf, page_nums):
+                    preview_end = time.perf_counter() + _PageProducer.PREVIEW_BUDGET
+                    if render_times.get(path_to_pdf, math.inf) < _PageProducer.PREVIEW_BUDGET:
+                        preview_end = 0
+                    preview_time = 0
+                    for preview_num, page_num in enumerate(page_nums, 1):
+                        preview_info = None
+                        # a preview is only started when one more like the last still fits in the budget
+                        if (preview_start := time.perf_counter()) + preview_time < preview_end:
+                            try:
+                                pixmap = _PageProducer._document(documents, path_to_pdf)[page_num].get_pixmap(
+                                    matrix=preview_matrix)
+                                preview_info = (pixmap.samples, pixmap.width, pixmap.height, pixmap.stride, pixmap.alpha)
+                            except Exception:
+                                preview_end = 0
+                            preview_time = time.perf_counter() - preview_start
+                        with result_lock:
+                            result_conn.send(('preview', generation, worker_id, page_num, preview_info,
+                                              preview_num == len(page_nums)))
+                    if TRACER.enabled:
+                        TRACER.span('preview', task_start, pages=len(page_nums))
+                case ('prefetch', path_to_pdf, doc_hash, page_num, page_ratio):
+                    try:
+                        pdf = _PageProducer._document(documents, path_to_pdf)
+                        if render_cache and page_num < pdf.page_count:
+                            page = pdf[page_num]
+                            pixmap = page.get_pixmap(matrix=_PageProducer._page_matrix(page, page_ratio))
+                            render_cache.write(doc_hash, page_num, _PageProducer.RENDER_SCALE * page_ratio, pixmap.width,
+                                               pixmap.height, pixmap.stride, pixmap.alpha, pixmap.samples_mv)
+                    except Exception:
+                        pass
+                    if TRACER.enabled:
+                        TRACER.span('prefetch', task_start, page=page_num)
+                    with result_lock:
+                        result_conn.send(('prefetch', worker_id))
+                case ('thumbs', generation, path_to_pdf, doc_hash, chunk):
+                    try:
+                        pdf = _PageProducer._document(documents, path_to_pdf)
+                        first_page = chunk * RenderCache.THUMBNAIL_CHUNK
+                        render_cache.writeThumbnails(doc_hash, chunk, [
+                            pdf[page_num].get_pixmap(matrix=thumbnail_matrix).tobytes('jpeg', jpg_quality=75)
+                            for page_num in range(first_page, min(first_page + RenderCache.THUMBNAIL_CHUNK, pdf.page_count))])
+                    except Exception:
+                        pass
+                    if TRACER.enabled:
+                        TRACER.span('thumbs', task_start, chunk=chunk)
+                    with result_lock:
+                        result_conn.send(('thumbs', generation, worker_id, doc_hash, chunk))
+                case ('render', generation, path_to_pdf, doc_hash, page_key, slot, page_ratio):
+                    if cancelled[slot]:
+                        # scrolled past before the task got here, the slot goes straight back
+                        with result_lock:
+                            result_conn.send(('page', generation, worker_id, slot, 0, page_key, 0, 0, 0, False))
+                        continue
+                    if page_buff is None or page_buff.name != buff_name:
+                        if page_buff:
+                            page_buff.close()
+                        page_buff = shared_memory.SharedMemory(name=buff_name)
+
+                    render_start = time.perf_counter()
+                    try:
+                        pdf = _PageProducer._document(documents, path_to_pdf)
+                        pixmap, page_info = _PageProducer._render(pdf, page_key, page_buff, slot * slot_size, transport,
+                                                                  page_ratio)
+                    except Exception:
+                        # a negative size tells the viewer not to ask for this page again
+                        pixmap, page_info = None, (-1, page_key, 0, 0, 0, False)
+                    if pixmap is not None and not isinstance(page_key, tuple):
+                        render_times[path_to_pdf] = time.perf_counter() - render_start
+                    if TRACER.enabled:
+                        send_start = time.perf_counter_ns()
+                    with result_lock:
+                        result_conn.send(('page', generation, worker_id, slot) + page_info)
+                    if TRACER.enabled:
+                        TRACER.span('send', send_start, page=str(page_key))
+                        cache_start = time.perf_counter_ns()
+                    # cache write happens after the viewer already has the page, tiles are not cached
+                    if pixmap is not None and render_cache and doc_hash and not isinstance(page_key, tuple):
+                        try:
+                            render_cache.write(doc_hash, page_key, _PageProducer.RENDER_SCALE * page_ratio,
+                                               pixmap.width, pixmap.height,
+                                               pixmap.stride, pixmap.alpha, pixmap.samples_mv)
+                        except OSError:
+                            pass
+                        if TRACER.enabled:
+                            TRACER.span('cache_write', cache_start, page=page_key)
+            if TRACER.enabled and TRACER.events:
+                with result_lock:
+                    result_conn.send(('trace', TRACER.flush()))
+        for pdf in documents.values():
+            pdf.close()
+        if page_buff:
+            page_buff.close()
+    @staticmethod
+    def _document(documents, path_to_pdf):
+        # a few recently used documents stay open in every worker
+        import fitz
+        if path_to_pdf not in documents:
+            documents[path_to_pdf] = fitz.open(path_to_pdf)
+            if len(documents) > _PageProducer.OPEN_DOCUMENTS:
+                documents.popitem(last=False)[1].close()
+        documents.move_to_end(path_to_pdf)
+        return documents[path_to_pdf]
+    @staticmethod
+    def _metadata(pdf, field, is_stale=lambda: False):
+        match field:
+            case 'page_sizes':
+                return [(page.rect.width, page.rect.height) for page in pdf]
+            case 'outline':
+                return _PageProducer._outline(pdf, is_stale)
+    @staticmethod
+    def _outline(pdf, is_stale=lambda: False):
+        # the document outline when there is one, otherwise short lines set noticeably larger than the body text
+        # the scan reads every page, it stops between chunks of pages once the document is switched away from
+        import fitz
+        if toc := pdf.get_toc(simple=True):
+            return [(level, title, page_num - 1) for level, title, page_num in toc if page_num > 0]
+        lines, size_chars = [], defaultdict(int)
+        for page in pdf:
+            if page.number % _PageProducer.HEADING_CHUNK == 0 and is_stale():
+                return None
+            for block in page.get_text('dict', flags=fitz.TEXTFLAGS_TEXT)['blocks']:
+                for line in block.get('lines', []):
+                    if not (text := ''.join(span['text'] for span in line['spans']).strip()):
+                        continue
+                    size = round(max(span['size'] for span in line['spans']))
+                    size_chars[size] += len(text)
+                    lines.append((size, text, page.number))
+        if not lines:
+            return []
+        body_size = max(size_chars, key=size_chars.get)
+        headings = [(size, text, page_num) for size, text, page_num in lines
+                    if size >= body_size * _PageProducer.HEADING_RATIO and len(text) <= _PageProducer.HEADING_LENGTH]
+        heading_sizes = sorted({size for size, _, _ in headings}, reverse=True)[:_PageProducer.HEADING_LEVELS]
+        return [(heading_sizes.index(size) + 1, text, page_num) for size, text, page_num in headings if size in heading_sizes]
+    @staticmethod
+    def _page_matrix(page, page_ratio):
+        # straight to the pixel size the viewer shows, rounded the same way as _PageGeometry.pixelSize
+        import fitz
+        width = max(1, round(page.rect.width * _PageProducer.RENDER_SCALE * page_ratio))
+        height = max(1, round(page.rect.height * _PageProducer.RENDER_SCALE * page_ratio))
+        return fitz.Matrix(width / page.rect.width, height / page.rect.height)
+    @staticmethod
+    def _render(pdf, page_key, page_buff, slot_offset, transport, page_ratio=1):
+        import fitz
+        if TRACER.enabled:
+            render_start = time.perf_counter_ns()
+        if isinstance(page_key, tuple):
+            # only the clipped tile is rasterised at the zoomed scale
+            page_num, lod, tile_x, tile_y = page_key
+            tile_scale = _PageProducer.RENDER_SCALE * lod
+            tile_span = _PageProducer.TILE_SIZE / tile_scale
+            tile_rect = fitz.Rect(tile_x * tile_span, tile_y * tile_span, (tile_x + 1) * tile_span, (tile_y + 1) * tile_span)
+            pixmap = pdf[page_num].get_pixmap(matrix=fitz.Matrix(tile_scale, tile_scale), clip=tile_rect & pdf[page_num].rect)
+        else:
+            page = pdf[page_key]
+            pixmap = page.get_pixmap(matrix=_PageProducer._page_matrix(page, page_ratio))  # ~ 0.02 sec/page at 2x | limitless stage
+        if TRACER.enabled:
+            TRACER.span('render', render_start, page=str(page_key))
+            encode_start = time.perf_counter_ns()
+        if transport == 'png':
+            page_bytes = pixmap.tobytes()  # automatically convert to png
+        else:
+            page_bytes = pixmap.samples_mv  # raw RGB(A) samples, no encoding
 
         page_size = len(page_bytes)
-        self.page_buff.buf[0: page_size] = page_bytes
-        self.worker_conn.send((page_size, page_num))
-        return self.worker_conn.recv()
-
+        page_buff.buf[slot_offset: slot_offset + page_size] = page_bytes
+        if TRACER.enabled:
+            TRACER.span('encode', encode_start, transport=transport, bytes=page_size)
+        return pixmap, (page_size, page_key, pixmap.width, pixmap.height, pixmap.stride, pixmap.alpha)
 
 # 1
     # Переместить добавление протоколов в ARR Submenu
@@ -625,8 +2350,6 @@ class _PageProducer:
 # 3
     # настроить стиль скроллбаров (убрать кнопки, настроить отображение) при двиежнии мыши показывать, без движенния - нет (проверить, что при wheelEvent корректно срабатывает)
     # добавить направление добавления картинок (при wheel)
-    # добавить zoom (через тачбар + виджет)
-    # вызывать завершение процесса, при выходе из приложения
 
 # 4
     # Во Viewer добавить панель: zoom, toggle режим
@@ -1,10 +1,11 @@
+import importlib
+import time
+
 from PySide6.QtCore import Qt, Signal
 from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QMainWindow, QWidget, QLabel, QHBoxLayout, QVBoxLayout, QButtonGroup, QStackedWidget, \
     QPushButton, QGridLayout, QGraphicsOpacityEffect
 
-from GUI.DLTabs import Documents, KanbanBoard
-
 class AppWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -186,20 +187,38 @@ class AppSidebar(QWidget):
             button.style().unpolish(button)
             button.style().polish(button)
 class AppTabs(QStackedWidget):
+    # tab classes from GUI.DLTabs, None stays an empty page
+    TABS = {'Home': None, 'Protocols': 'Documents', 'Projects': None, 'BioInformatics': None, 'Kanban': 'KanbanBoard',
+            'Archive': None, 'Settings': None}
     def __init__(self, qsignal):
         super().__init__()
         self.qsignal = qsignal
         self.qsignal.connect(self._update_tab)
+        self.construction_times = {}
 
         self._setup()
         self._adjust_layout()
     def _setup(self):
-        tabs = {'Home': QWidget, 'Protocols': Documents, 'Projects': QWidget, 'BioInformatics': QWidget, 'Kanban': KanbanBoard, 'Archive': QWidget, 'Settings': QWidget}
-        for name, widget in tabs.items():
-            tab = widget()
-            self.addWidget(tab)
+        # every tab starts as a placeholder and is built on its first activation, the app opens on Home
+        for name in AppTabs.TABS:
+            self.addWidget(QWidget())
+        self._build_tab(0)
     def _adjust_layout(self):
         self.layout().setContentsMargins(0, 0, 0, 0)
         self.layout().setSpacing(0)
+    def _build_tab(self, index):
+        name, tab_class = list(AppTabs.TABS.items())[index]
+        if name in self.construction_times:
+            return
+        start = time.perf_counter()
+        if tab_class:
+            # DLTabs brings the viewer, search and storage along, it is imported with the first such tab
+            tab = getattr(importlib.import_module('GUI.DLTabs'), tab_class)()
+            placeholder = self.widget(index)
+            self.removeWidget(placeholder)
+            self.insertWidget(index, tab)
+            placeholder.deleteLater()
+        self.construction_times[name] = time.perf_counter() - start
     def _update_tab(self, index):
+        self._build_tab(index)
         self.setCurrentIndex(index)
\ No newline at end of file
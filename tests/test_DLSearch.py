@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from GUI.DLSearch import SearchIndex
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.search_index = SearchIndex(os.path.join(self.temp_dir.name, 'search.sqlite3'))
+        self.search_index.addDocument('agarose.pdf', 'a' * 32, ['Agarose gel buffer', 'Run the gel at 100 V'])
+        self.search_index.addDocument('plasmid.pdf', 'b' * 32, ['Plasmid prep buffer', 'Elute the plasmid'])
+
+    def tearDown(self):
+        self.search_index.close()
+        self.temp_dir.cleanup()
+
+    def pages(self, text):
+        return [(path, page_num) for path, page_num, _ in self.search_index.query(text)]
+
+    def testAllTermsOnOnePage(self):
+        self.assertEqual(self.pages('buffer'), [('agarose.pdf', 0), ('plasmid.pdf', 0)])
+        self.assertEqual(self.pages('gel buffer'), [('agarose.pdf', 0)])
+        # both terms occur in the document, but never on the same page
+        self.assertEqual(self.pages('agarose 100'), [])
+
+    def testPrefixOnLastTerm(self):
+        self.assertEqual(self.pages('plas'), [('plasmid.pdf', 0), ('plasmid.pdf', 1)])
+        self.assertEqual(self.pages('elute plas'), [('plasmid.pdf', 1)])
+        # only the term still being typed is completed, and only from PREFIX_LENGTH characters on
+        self.assertEqual(self.pages('plas elute'), [])
+        self.assertEqual(self.pages('p'), [])
+
+    def testSnippetAroundFirstTerm(self):
+        (_, _, snippet), = self.search_index.query('elute')
+        self.assertEqual(snippet, 'Elute the plasmid')
+
+    def testRemoveKeepsSharedContent(self):
+        # a copy of the same content is recorded under its own path without another extraction
+        self.search_index.addDocument('copy.pdf', 'a' * 32, [])
+        self.search_index.removeDocument('agarose.pdf')
+        self.assertTrue(self.search_index.isIndexed('a' * 32))
+        self.assertEqual(self.pages('agarose'), [('copy.pdf', 0)])
+        self.search_index.removeDocument('copy.pdf')
+        self.assertFalse(self.search_index.isIndexed('a' * 32))
+        self.assertEqual(self.pages('agarose'), [])
+        self.assertEqual(self.search_index.paths(), {'plasmid.pdf'})
+
+    def testDocumentWithoutTextCountsAsIndexed(self):
+        self.search_index.addDocument('scan.pdf', 'c' * 32, [])
+        self.assertTrue(self.search_index.isIndexed('c' * 32))
+        self.assertEqual(self.pages('buffer'), [('agarose.pdf', 0), ('plasmid.pdf', 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+
+from GUI.DLStorage import ObjectStore, RenderCache, SidebarStore, contentHash, migrateToObjects
+
+
+class ObjectStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = self.temp_dir.name
+        self.source_path = os.path.join(self.root, 'protocol.pdf')
+        with open(self.source_path, 'wb') as _source:
+            _source.write(b'%PDF-1.4 protocol')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def testObjectsPathWithoutSeparator(self):
+        # objects land inside the directory whether or not its path ends with a separator
+        objects_path = os.path.join(self.root, 'objects')
+        object_store = ObjectStore(objects_path)
+        object_path, doc_hash = object_store.importDocument(self.source_path)
+        self.assertEqual(object_path, os.path.join(objects_path, doc_hash))
+        self.assertTrue(os.path.isfile(object_path))
+        self.assertTrue(object_store.isObject(object_path))
+        self.assertEqual(object_store.addObject(doc_hash), object_path)
+        self.assertEqual(ObjectStore(objects_path).objectPath(doc_hash), object_path)
+
+    def testReleaseRemovesWithLastReference(self):
+        object_store = ObjectStore(os.path.join(self.root, 'objects'))
+        object_path, doc_hash = object_store.importDocument(self.source_path)
+        object_store.retain(doc_hash)
+        object_store.retain(doc_hash)
+        object_store.release(doc_hash)
+        self.assertTrue(os.path.exists(object_path))
+        object_store.release(doc_hash)
+        self.assertFalse(os.path.exists(object_path))
+        self.assertFalse(object_store.contains(doc_hash))
+
+    def testMigrateToObjects(self):
+        # two sections holding copies of the same document end up referencing one object
+        doc_hash = contentHash(self.source_path)
+        content = {}
+        for section in ('Section A', 'Section B'):
+            section_path = os.path.join(self.root, section)
+            os.makedirs(section_path)
+            content[section] = os.path.join(section_path, doc_hash)
+            with open(self.source_path, 'rb') as _source, open(content[section], 'wb') as _copy:
+                _copy.write(_source.read())
+        sidebar_store = SidebarStore(os.path.join(self.root, 'sidebar.sqlite3'))
+        for section, path in content.items():
+            sidebar_store.addSection({'Path': os.path.dirname(path), 'Label': section, 'Content': {'Protocol': path}})
+        objects_path = os.path.join(self.root, 'objects')
+        object_store = ObjectStore(objects_path)
+
+        self.assertEqual(migrateToObjects(sidebar_store, object_store), 2)
+        object_path = os.path.join(objects_path, doc_hash)
+        self.assertTrue(os.path.isfile(object_path))
+        self.assertFalse(any(os.path.exists(path) for path in content.values()))
+        self.assertEqual([image['Content'] for image in sidebar_store.load()['Sections']],
+                         [{'Protocol': object_path}] * 2)
+        sidebar_store.close()
+
+
+class RenderCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.page_size = RenderCache.HEADER.size + 100 * 300
+        self.render_cache = RenderCache(self.temp_dir.name, cache_limit=3 * self.page_size)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def writePage(self, page_num):
+        self.render_cache.write('doc', page_num, 2, 100, 100, 300, False, bytes(100 * 300))
+
+    def testReadTruncatedEntry(self):
+        self.writePage(0)
+        self.assertIsNotNone(self.render_cache.read('doc', 0, 2))
+        with open(self.render_cache.entryPath('doc', 0, 2), 'wb') as _entry:
+            _entry.write(b'DL')
+        self.assertIsNone(self.render_cache.read('doc', 0, 2))
+
+    def testLimitKeptOnWrite(self):
+        for page_num in range(5):
+            self.writePage(page_num)
+        self.writePage(4)  # an overwrite does not count twice
+        self.assertEqual(self.render_cache.cache_size.value, 3 * self.page_size)
+        self.assertEqual([self.render_cache.hasPage('doc', page_num, 2) for page_num in range(5)],
+                         [False, False, True, True, True])
+
+
+class SidebarStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sidebar_store = SidebarStore(os.path.join(self.temp_dir.name, 'sidebar.sqlite3'))
+
+    def tearDown(self):
+        self.sidebar_store.close()
+        self.temp_dir.cleanup()
+
+    def testUpdateKeepsOrder(self):
+        self.sidebar_store.addSection({'Path': 'a', 'Label': 'A', 'Content': {'one': 'p1', 'two': 'p2'}})
+        self.sidebar_store.addSection({'Path': 'b', 'Label': 'B', 'Content': {}})
+        self.sidebar_store.updateSection({'Path': 'a', 'Label': 'A2', 'Content': {'one': 'p1', 'three': 'p3'}})
+        self.sidebar_store.renameDocument('a', 'one', 'first')
+        self.assertEqual(self.sidebar_store.load()['Sections'],
+                         [{'Path': 'a', 'Label': 'A2', 'Content': {'first': 'p1', 'three': 'p3'}},
+                          {'Path': 'b', 'Label': 'B', 'Content': {}}])
+        self.sidebar_store.removeSection('a')
+        self.assertEqual([image['Path'] for image in self.sidebar_store.load()['Sections']], ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()